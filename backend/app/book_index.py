@@ -0,0 +1,36 @@
+# app/book_index.py
+"""
+index.json of a converted book: {"sections": [...], "complete": bool}.
+Conversion rewrites it after every section, so the viewer can open the
+first chapter while the rest is still being converted. Older books have
+a bare list of sections, which reads as complete.
+"""
+import json
+import os
+
+INDEX_NAME = "index.json"
+
+
+def index_path(parsed_dir: str) -> str:
+    return os.path.join(parsed_dir, INDEX_NAME)
+
+
+def write_index(parsed_dir: str, sections: list, complete: bool):
+    """Replace the index atomically so readers never see a partial file."""
+    path = index_path(parsed_dir)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"sections": sorted(sections), "complete": complete}, f)
+    os.replace(tmp_path, path)
+
+
+def read_index(parsed_dir: str) -> tuple[list, bool]:
+    """Return (sections, complete); ([], False) if there is no index yet."""
+    try:
+        with open(index_path(parsed_dir)) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return [], False
+    if isinstance(data, list):
+        return data, True
+    return data.get("sections", []), bool(data.get("complete"))
@@ -0,0 +1,113 @@
+# app/book_pack.py
+"""
+Packed form of a converted book: every section's UTF-8 text back to back
+in book.pack, and book.pack.json listing each section's name, title, byte
+offset, length and word count. The API maps the pack once and serves
+sections as slices of it, instead of one static file per section.
+"""
+import hashlib
+import json
+import mmap
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from app.book_index import read_index
+
+PACK_BOOKS = os.getenv("PACK_BOOKS", "1") == "1"
+PACK_NAME = "book.pack"
+PACK_INDEX_NAME = "book.pack.json"
+# Packs kept mapped per process, least recently used dropped first
+PACK_CACHE_SIZE = int(os.getenv("PACK_CACHE_SIZE", 64))
+
+_lock = threading.Lock()
+_open_packs: OrderedDict[str, tuple[float, "PackedBook"]] = OrderedDict()
+
+
+def section_title(name: str) -> str:
+    # "003_chapter_one.txt" (or "01_003_..." from archives) -> "chapter one"
+    stem = re.sub(r'^(\d+_)+', '', os.path.splitext(name)[0])
+    return stem.replace('_', ' ').strip() or name
+
+
+def pack_book(parsed_dir: str) -> str | None:
+    """
+    Write the pack for a completely converted book. Both files are
+    replaced atomically, the index last, so a reader never sees an index
+    pointing past the content it has. Returns the index path.
+    """
+    sections, complete = read_index(parsed_dir)
+    if not complete:
+        return None
+
+    pack_path = os.path.join(parsed_dir, PACK_NAME)
+    index_path = os.path.join(parsed_dir, PACK_INDEX_NAME)
+    suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+    digest = hashlib.sha256()
+    entries = []
+    offset = 0
+    with open(pack_path + suffix, "wb") as pack:
+        for name in sections:
+            with open(os.path.join(parsed_dir, name), "rb") as f:
+                data = f.read()
+            pack.write(data)
+            digest.update(data)
+            entries.append({
+                "name": name,
+                "title": section_title(name),
+                "offset": offset,
+                "length": len(data),
+                "words": len(data.decode("utf-8", errors="replace").split()),
+            })
+            offset += len(data)
+
+    with open(index_path + suffix, "w") as f:
+        json.dump({"etag": digest.hexdigest()[:32], "size": offset, "sections": entries}, f)
+    os.replace(pack_path + suffix, pack_path)
+    os.replace(index_path + suffix, index_path)
+    return index_path
+
+
+class PackedBook:
+    """A memory-mapped pack; section() slices are zero-copy views into it."""
+
+    def __init__(self, parsed_dir: str):
+        with open(os.path.join(parsed_dir, PACK_INDEX_NAME)) as f:
+            index = json.load(f)
+        self.etag = index["etag"]
+        self.sections = index["sections"]
+        with open(os.path.join(parsed_dir, PACK_NAME), "rb") as f:
+            # An empty file can't be mapped; a book with no text has nothing to slice
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if index["size"] else b""
+        self._view = memoryview(self._map)
+
+    def section(self, n: int) -> memoryview:
+        entry = self.sections[n]
+        return self._view[entry["offset"]:entry["offset"] + entry["length"]]
+
+
+def open_packed(parsed_dir: str) -> PackedBook | None:
+    """
+    The pack for a book, mapped once per process and re-opened when the
+    pack is rewritten; None if the book has no pack.
+    """
+    index_path = os.path.join(parsed_dir, PACK_INDEX_NAME)
+    try:
+        key = os.path.realpath(index_path)
+        mtime = os.path.getmtime(index_path)
+    except OSError:
+        return None
+    with _lock:
+        cached = _open_packs.get(key)
+        if cached and cached[0] == mtime:
+            _open_packs.move_to_end(key)
+            return cached[1]
+    book = PackedBook(parsed_dir)
+    with _lock:
+        # Dropped maps are never closed explicitly: responses may still hold views
+        _open_packs[key] = (mtime, book)
+        _open_packs.move_to_end(key)
+        while len(_open_packs) > PACK_CACHE_SIZE:
+            _open_packs.popitem(last=False)
+    return book
@@ -0,0 +1,235 @@
+# app/book_store.py
+"""
+Content-addressed store shared by every job. A downloaded file lives once
+under store/{sha256}/ next to its converted sections and pre-rendered
+audio; job directories only hold symlinks into it. A second index maps the
+normalized (title, author) of a guess to the SHA-256 of the file that was
+downloaded for it, so a repeat request skips IRC and conversion entirely.
+Concurrent requests for the same guess are collapsed by a Redis download
+claim: one job fetches the book, the others wait for it to be ingested.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+
+from app.book_index import index_path, read_index
+from app.job_store import redis_client
+
+BOOKS_DIR = os.getenv("BOOKS_DIR", "/data/books")
+STORE_DIR = os.path.join(BOOKS_DIR, "store")
+TITLES_DIR = os.path.join(STORE_DIR, "titles")
+HASH_CHUNK_SIZE = 1024 * 1024
+# An unfinished conversion whose index hasn't moved for this long is taken over
+CONVERT_STALL_TIMEOUT = float(os.getenv("CONVERT_STALL_TIMEOUT", 600))
+# A download claim outlives a search plus a book transfer; if its job dies
+# the claim expires and a waiting job takes over
+DOWNLOAD_CLAIM_TTL = int(os.getenv("DOWNLOAD_CLAIM_TTL", 3600))
+DOWNLOAD_CLAIM_PREFIX = "book:download"
+
+
+def title_key(title: str, author: str) -> str:
+    normalized = [" ".join(re.findall(r"\w+", (s or "").lower())) for s in (title, author)]
+    return hashlib.sha256(json.dumps(normalized).encode("utf-8")).hexdigest()
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def book_dir(sha: str) -> str:
+    return os.path.join(STORE_DIR, sha)
+
+
+def parsed_dir(sha: str) -> str:
+    return os.path.join(book_dir(sha), "parsed")
+
+
+def is_converted(sha: str) -> bool:
+    return read_index(parsed_dir(sha))[1]
+
+
+def _write_json(path: str, data: dict):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _symlink(target: str, link: str):
+    # Replace whatever is there (a real file or an older link) atomically
+    tmp_link = f"{link}.{os.getpid()}.lnk"
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(target, tmp_link)
+    os.replace(tmp_link, link)
+
+
+def find_stored(title: str, author: str) -> dict | None:
+    """The stored book entry for a guess, if one was downloaded and is still there."""
+    try:
+        with open(os.path.join(TITLES_DIR, f"{title_key(title, author)}.json")) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return entry if os.path.isfile(os.path.join(book_dir(entry["sha256"]), entry["filename"])) else None
+
+
+def find_converted(title: str, author: str) -> dict | None:
+    """The stored book entry for a guess, if one was downloaded and converted."""
+    entry = find_stored(title, author)
+    return entry if entry and is_converted(entry["sha256"]) else None
+
+
+def _download_claim_key(title: str, author: str) -> str:
+    return f"{DOWNLOAD_CLAIM_PREFIX}:{title_key(title, author)}"
+
+
+def claim_download(title: str, author: str, owner: str) -> bool:
+    """
+    Claim the download of a guess for one download workflow (owner is its
+    Celery root task id). Returns False while anyone else holds the claim,
+    including another workflow of the same job; a redelivered task of the
+    owning workflow keeps it.
+    """
+    key = _download_claim_key(title, author)
+    if redis_client.set(key, owner, nx=True, ex=DOWNLOAD_CLAIM_TTL):
+        return True
+    return redis_client.get(key) == owner.encode()
+
+
+def release_download(title: str, author: str, owner: str):
+    """Drop a workflow's download claim; anyone else's claim is left alone."""
+    key = _download_claim_key(title, author)
+    if redis_client.get(key) == owner.encode():
+        redis_client.delete(key)
+
+
+def wait_download(title: str, author: str, poll: float = 2.0) -> dict | None:
+    """
+    Follow another job's download of a guess. Returns the stored entry once
+    it is ingested, or None if the claim is dropped or expires without one.
+    """
+    key = _download_claim_key(title, author)
+    while True:
+        entry = find_stored(title, author)
+        if entry:
+            return entry
+        if not redis_client.exists(key):
+            # Ingest writes the entry before the claim goes, so look once more
+            return find_stored(title, author)
+        time.sleep(poll)
+
+
+def ingest(path: str, title: str, author: str) -> dict:
+    """
+    Move a downloaded file into the store, or drop it if identical bytes are
+    already there, and leave a symlink at its old path. Returns the entry
+    {'sha256', 'filename'} for the stored copy.
+    """
+    sha = file_sha256(path)
+    stored = os.path.join(book_dir(sha), os.path.basename(path))
+    existing = [f for f in os.listdir(book_dir(sha)) if os.path.isfile(os.path.join(book_dir(sha), f))] \
+        if os.path.isdir(book_dir(sha)) else []
+    if existing:
+        # Same content under whatever name it first arrived with
+        stored = os.path.join(book_dir(sha), existing[0])
+        os.remove(path)
+    else:
+        os.makedirs(book_dir(sha), exist_ok=True)
+        shutil.move(path, stored)
+    _symlink(stored, path)
+
+    entry = {"sha256": sha, "filename": os.path.basename(stored)}
+    if title:
+        _write_json(os.path.join(TITLES_DIR, f"{title_key(title, author)}.json"), entry)
+    return entry
+
+
+def link_job(job_id: str, entry: dict) -> str:
+    """
+    Point a job's ebook file, parsed/ and audio/ at the stored book. Returns
+    the job-local path of the ebook.
+    """
+    sha = entry["sha256"]
+    job_dir = os.path.join(BOOKS_DIR, job_id)
+    os.makedirs(job_dir, exist_ok=True)
+    # Pre-rendering writes through the audio link, so it must not dangle
+    os.makedirs(os.path.join(book_dir(sha), "audio"), exist_ok=True)
+    for name in ("parsed", "audio"):
+        _symlink(os.path.join(book_dir(sha), name), os.path.join(job_dir, name))
+
+    ebook_path = os.path.join(job_dir, entry["filename"])
+    if not os.path.lexists(ebook_path):
+        _symlink(os.path.join(book_dir(sha), entry["filename"]), ebook_path)
+    return ebook_path
+
+
+def _last_progress(sha: str) -> float:
+    # The index is rewritten after every section; the directory's mtime
+    # covers the stretch before the first one
+    times = []
+    for path in (index_path(parsed_dir(sha)), parsed_dir(sha)):
+        try:
+            times.append(os.path.getmtime(path))
+        except OSError:
+            pass
+    return max(times, default=0.0)
+
+
+def _stalled(sha: str) -> bool:
+    return not is_converted(sha) and time.time() - _last_progress(sha) > CONVERT_STALL_TIMEOUT
+
+
+def claim_conversion(sha: str) -> bool:
+    """
+    Claim the right to convert a stored book by creating its parsed/
+    directory. Returns False if another job holds it, unless that
+    conversion stalled, in which case its output is cleared and retaken.
+    """
+    os.makedirs(book_dir(sha), exist_ok=True)
+    try:
+        os.mkdir(parsed_dir(sha))
+        return True
+    except FileExistsError:
+        if not _stalled(sha):
+            return False
+    abandoned = f"{parsed_dir(sha)}.stale.{os.getpid()}.{time.time():.0f}"
+    try:
+        os.rename(parsed_dir(sha), abandoned)
+    except OSError:
+        # Someone else got there first
+        return False
+    shutil.rmtree(abandoned, ignore_errors=True)
+    return claim_conversion(sha)
+
+
+def release_conversion(sha: str):
+    """Drop a failed conversion so the next job can claim it straight away."""
+    shutil.rmtree(parsed_dir(sha), ignore_errors=True)
+
+
+def wait_converted(sha: str, on_progress=None, poll: float = 2.0) -> bool:
+    """
+    Follow another job's conversion of a stored book. Returns True once it
+    completes, False if it stalls. on_progress gets the section count as
+    it grows.
+    """
+    reported = 0
+    while True:
+        sections, complete = read_index(parsed_dir(sha))
+        if on_progress and len(sections) != reported:
+            reported = len(sections)
+            on_progress(reported)
+        if complete:
+            return True
+        if _stalled(sha):
+            return False
+        time.sleep(poll)
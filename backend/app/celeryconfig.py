@@ -8,10 +8,45 @@ celery_app = Celery(
     backend=os.getenv("CELERY_RESULT_BACKEND", "redis://redis:6379/1")
 )
 
-# Optional: customize task routes or serialization
+# Each queue is served by its own worker service (see docker-compose.yml) so
+# long IRC waits and PDF parsing never hold a slot an audio turn needs:
+#   interactive - transcribe/guess turns, prefork
+#   download    - IRC searches and DCC transfers, mostly waiting: threads
+#   conversion  - ebook parsing, threads: PDFs fan out to their own process
+#                 pool, which prefork's daemonic children can't start
+#   tts         - background audio rendering, single slot
+# Redis priorities run 0 (first) to 9 (last).
+task_routes = {
+    'app.tasks.process_audio_job': {'queue': 'interactive', 'priority': 0},
+    'app.tasks.process_turn': {'queue': 'interactive', 'priority': 0},
+    'app.tasks.transcribe_audio': {'queue': 'interactive', 'priority': 0},
+    'app.tasks.guess_book': {'queue': 'interactive', 'priority': 0},
+    'app.tasks.download_book_task': {'queue': 'interactive', 'priority': 3},
+    'app.tasks.link_stored_book': {'queue': 'interactive', 'priority': 3},
+    'app.tasks.download_list_task': {'queue': 'download', 'priority': 3},
+    'app.tasks.actually_download_book': {'queue': 'download', 'priority': 3},
+    'app.tasks.convert_book_task': {'queue': 'conversion', 'priority': 5},
+    'app.tasks.prerender_book_audio': {'queue': 'tts', 'priority': 9},
+    'app.tasks.speak_text': {'queue': 'tts', 'priority': 9},
+}
+
 celery_app.conf.update(
     task_track_started=True,
     task_serializer='json',
     result_serializer='json',
     accept_content=['json'],
-)
\ No newline at end of file
+    task_routes=task_routes,
+    task_default_queue='interactive',
+    task_default_priority=5,
+    # Tasks are long and few: take one at a time and ack only when done, so
+    # a busy worker never hoards queued turns and a crash re-queues its task
+    worker_prefetch_multiplier=int(os.getenv("CELERY_PREFETCH_MULTIPLIER", 1)),
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    broker_transport_options={
+        'priority_steps': list(range(10)),
+        'queue_order_strategy': 'priority',
+        # Must outlast the slowest task or acks_late redelivers it mid-run
+        'visibility_timeout': int(os.getenv("CELERY_VISIBILITY_TIMEOUT", 4 * 3600)),
+    },
+)
@@ -0,0 +1,73 @@
+# app/guess_cache.py
+"""
+Cache of LLM guesses keyed on the exact prompt the model would see. The
+model runs at temperature 0, so an identical (normalized) conversation
+gets the identical answer without another API call.
+"""
+import hashlib
+import json
+import os
+import re
+import time
+
+import redis
+
+GUESS_CACHE_ENABLED = os.getenv("GUESS_CACHE", "1") == "1"
+GUESS_CACHE_TTL = int(os.getenv("GUESS_CACHE_TTL", 7 * 24 * 3600))
+GUESS_CACHE_MAX_ENTRIES = int(os.getenv("GUESS_CACHE_MAX_ENTRIES", 10000))
+
+PREFIX = "guess_cache"
+LRU_KEY = f"{PREFIX}:lru"
+STATS_KEY = f"{PREFIX}:stats"
+
+redis_client = redis.Redis(
+    host=os.getenv("REDIS_HOST", "redis"),
+    port=int(os.getenv("REDIS_PORT", 6379)),
+    db=3
+)
+
+
+def normalize_text(text: str) -> str:
+    # Case, spacing and trailing punctuation don't change what the user means
+    return re.sub(r'\s+', ' ', text).strip().lower().rstrip('.!?')
+
+
+def cache_key(system_prompt: str, model: str, history: list) -> str:
+    normalized = [(m.get("role"), normalize_text(m.get("content") or "")) for m in history]
+    payload = json.dumps([system_prompt, model, normalized])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get(key: str) -> dict | None:
+    entry_key = f"{PREFIX}:{key}"
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.get(entry_key)
+    pipe.zadd(LRU_KEY, {key: time.time()}, xx=True)
+    cached = pipe.execute()[0]
+
+    redis_client.hincrby(STATS_KEY, "hits" if cached else "misses", 1)
+    return json.loads(cached) if cached else None
+
+
+def put(key: str, guess: dict):
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.set(f"{PREFIX}:{key}", json.dumps(guess), ex=GUESS_CACHE_TTL)
+    pipe.zadd(LRU_KEY, {key: time.time()})
+    pipe.zcard(LRU_KEY)
+    size = pipe.execute()[-1]
+
+    if size > GUESS_CACHE_MAX_ENTRIES:
+        # Evict least recently used entries; TTL handles the rest
+        evicted = redis_client.zpopmin(LRU_KEY, size - GUESS_CACHE_MAX_ENTRIES)
+        if evicted:
+            redis_client.delete(*(f"{PREFIX}:{k.decode()}" for k, _ in evicted))
+            redis_client.hincrby(STATS_KEY, "evictions", len(evicted))
+
+
+def stats() -> dict:
+    raw = redis_client.hgetall(STATS_KEY)
+    result = {k.decode(): int(v) for k, v in raw.items()}
+    hits, misses = result.get("hits", 0), result.get("misses", 0)
+    result["hit_rate"] = hits / (hits + misses) if hits + misses else 0.0
+    result["entries"] = redis_client.zcard(LRU_KEY)
+    return result
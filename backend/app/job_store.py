@@ -1,7 +1,9 @@
 # app/job_store.py
+import asyncio
 from typing import Any
 
 import redis
+import redis.asyncio as aioredis
 import json
 import os
 
@@ -12,16 +14,304 @@ redis_client = redis.Redis(
     db=2
 )
 
+# Shared pool for the FastAPI app. Connections are opened lazily; the app
+# pings it at startup and closes it on shutdown.
+async_redis_client = aioredis.Redis(
+    connection_pool=aioredis.ConnectionPool(
+        host=os.getenv("REDIS_HOST", "redis"),
+        port=int(os.getenv("REDIS_PORT", 6379)),
+        db=2,
+        max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", 100)),
+    )
+)
+
+# Pub/sub gets a connection of its own: a subscribed connection is pinned
+# for as long as it listens, and must never compete with request traffic
+# for slots in the pool above.
+_events_redis_client = aioredis.Redis(
+    host=os.getenv("REDIS_HOST", "redis"),
+    port=int(os.getenv("REDIS_PORT", 6379)),
+    db=2,
+)
+
+# Seconds between keep-alive ticks while a subscriber waits for updates
+EVENTS_KEEPALIVE = float(os.getenv("JOB_EVENTS_KEEPALIVE", 15))
+
+# "hash" keeps scalar fields in a Redis hash and history in an append-only
+# list, so concurrent writers never overwrite each other. "json" is the
+# original single-blob layout, kept for existing deployments.
+JOB_STORE_MODE = os.getenv("JOB_STORE_MODE", "hash").lower()
+
+
+def _history_key(job_id: str) -> str:
+    return f"{job_id}:history"
+
+
+def _events_channel(job_id: str) -> str:
+    return f"{job_id}:events"
+
+
+def _publish(pipe, job_id: str, fields: dict):
+    # Subscribers only care about scalar fields; history never goes out
+    event = {key: value for key, value in fields.items() if key != 'history'}
+    if event:
+        pipe.publish(_events_channel(job_id), json.dumps(event))
+
+
+def _encode_fields(data: dict) -> dict:
+    # Every hash field is stored as its own JSON document so dicts (guess)
+    # and None survive the round trip; ints stay HINCRBY-compatible.
+    return {key: json.dumps(value) for key, value in data.items()}
+
+
+def _decode_fields(raw: dict) -> dict:
+    return {key.decode(): json.loads(value) for key, value in raw.items()}
+
+
+# The _queue_* helpers only stage commands, so the same code drives both
+# sync and asyncio pipelines; callers execute (or await) the pipeline.
+
+def _queue_save(pipe, job_id: str, data: dict):
+    if JOB_STORE_MODE == "json":
+        pipe.set(job_id, json.dumps(data))
+        _publish(pipe, job_id, data)
+        return
+    fields = dict(data)
+    history = fields.pop('history', [])
+    pipe.delete(job_id, _history_key(job_id))
+    if fields:
+        pipe.hset(job_id, mapping=_encode_fields(fields))
+    if history:
+        pipe.rpush(_history_key(job_id), *(json.dumps(m) for m in history))
+    _publish(pipe, job_id, fields)
+
+
+def _queue_get_hash(pipe, job_id: str, include_history: bool):
+    pipe.hgetall(job_id)
+    if include_history:
+        pipe.lrange(_history_key(job_id), 0, -1)
+
+
+def _build_job_hash(results: list, include_history: bool) -> Any | None:
+    if not results[0]:
+        return None
+    job = _decode_fields(results[0])
+    if include_history:
+        job['history'] = [json.loads(m) for m in results[1]]
+    return job
+
+
+def _queue_update_hash(pipe, job_id: str, update: dict, append_history: list | None = None):
+    fields = dict(update)
+    history = fields.pop('history', None)
+    if fields:
+        pipe.hset(job_id, mapping=_encode_fields(fields))
+    if history is not None:
+        # An explicit 'history' replaces the list, matching the JSON layout
+        pipe.delete(_history_key(job_id))
+        if history:
+            pipe.rpush(_history_key(job_id), *(json.dumps(m) for m in history))
+    if append_history:
+        pipe.rpush(_history_key(job_id), *(json.dumps(m) for m in append_history))
+    _publish(pipe, job_id, fields)
+
+
+def _merge_json(job_data, update: dict, append_history: list | None) -> dict:
+    job = json.loads(job_data) if job_data else {}
+    job.update(update)
+    if append_history:
+        job['history'] = job.get('history', []) + list(append_history)
+    return job
+
+
+def _update_job_json(job_id: str, update: dict, append_history: list | None = None):
+    # WATCH/MULTI so concurrent read-modify-writes retry instead of clobbering
+    with redis_client.pipeline() as pipe:
+        while True:
+            try:
+                pipe.watch(job_id)
+                job = _merge_json(pipe.get(job_id), update, append_history)
+                pipe.multi()
+                pipe.set(job_id, json.dumps(job))
+                _publish(pipe, job_id, update)
+                pipe.execute()
+                return
+            except redis.WatchError:
+                continue
+
+
+async def _async_update_job_json(job_id: str, update: dict):
+    async with async_redis_client.pipeline() as pipe:
+        while True:
+            try:
+                await pipe.watch(job_id)
+                job = _merge_json(await pipe.get(job_id), update, None)
+                pipe.multi()
+                pipe.set(job_id, json.dumps(job))
+                _publish(pipe, job_id, update)
+                await pipe.execute()
+                return
+            except redis.WatchError:
+                continue
+
+
 def save_job(job_id: str, data: dict):
-    redis_client.set(job_id, json.dumps(data))
+    pipe = redis_client.pipeline(transaction=True)
+    _queue_save(pipe, job_id, data)
+    pipe.execute()
 
-def get_job(job_id: str) -> Any | None:
+
+def get_job(job_id: str, include_history: bool = True) -> Any | None:
+    if JOB_STORE_MODE != "json":
+        pipe = redis_client.pipeline(transaction=True)
+        _queue_get_hash(pipe, job_id, include_history)
+        try:
+            return _build_job_hash(pipe.execute(), include_history)
+        except redis.ResponseError:
+            # Job written by the old JSON layout before the mode switch
+            pass
     job_data = redis_client.get(job_id)
     if job_data:
         return json.loads(job_data)
     return None
 
-def update_job(job_id: str, update: dict):
+
+def get_history(job_id: str, start: int = 0) -> list:
+    """Return history messages from index start on, without the rest of the job."""
+    if JOB_STORE_MODE != "json":
+        try:
+            return [json.loads(m) for m in redis_client.lrange(_history_key(job_id), start, -1)]
+        except redis.ResponseError:
+            pass
     job = get_job(job_id) or {}
-    job.update(update)
-    save_job(job_id, job)
+    return job.get('history', [])[start:]
+
+
+def update_job(job_id: str, update: dict):
+    append_history(job_id, [], update)
+
+
+def append_history(job_id: str, messages: list, update: dict | None = None):
+    """
+    Append chat messages to the job history, optionally updating fields in
+    the same transaction.
+    """
+    if JOB_STORE_MODE == "json":
+        _update_job_json(job_id, update or {}, messages)
+        return
+    pipe = redis_client.pipeline(transaction=True)
+    _queue_update_hash(pipe, job_id, update or {}, messages)
+    pipe.execute()
+
+
+async def async_save_job(job_id: str, data: dict):
+    async with async_redis_client.pipeline(transaction=True) as pipe:
+        _queue_save(pipe, job_id, data)
+        await pipe.execute()
+
+
+async def async_get_job(job_id: str, include_history: bool = True) -> Any | None:
+    if JOB_STORE_MODE != "json":
+        async with async_redis_client.pipeline(transaction=True) as pipe:
+            _queue_get_hash(pipe, job_id, include_history)
+            try:
+                return _build_job_hash(await pipe.execute(), include_history)
+            except redis.ResponseError:
+                pass
+    job_data = await async_redis_client.get(job_id)
+    if job_data:
+        return json.loads(job_data)
+    return None
+
+
+async def async_update_job(job_id: str, update: dict):
+    if JOB_STORE_MODE == "json":
+        await _async_update_job_json(job_id, update)
+        return
+    async with async_redis_client.pipeline(transaction=True) as pipe:
+        _queue_update_hash(pipe, job_id, update)
+        await pipe.execute()
+
+
+# One pattern subscription per API process, fanned out to a queue per
+# /events stream; the number of open streams costs no Redis connections.
+_subscribers: dict[str, set[asyncio.Queue]] = {}
+_listener: asyncio.Task | None = None
+_listening = asyncio.Event()
+
+
+async def _listen_job_events():
+    suffix = _events_channel('')
+    while True:
+        pubsub = _events_redis_client.pubsub()
+        try:
+            await pubsub.psubscribe(_events_channel('*'))
+            _listening.set()
+            async for message in pubsub.listen():
+                if message['type'] != 'pmessage':
+                    continue
+                job_id = message['channel'].decode()[:-len(suffix)]
+                queues = _subscribers.get(job_id)
+                if not queues:
+                    continue
+                event = json.loads(message['data'])
+                for queue in queues:
+                    queue.put_nowait(event)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[WARN] Job event listener lost Redis, reconnecting: {e}")
+            await asyncio.sleep(1)
+        finally:
+            _listening.clear()
+            await pubsub.aclose()
+
+
+async def subscribe_job(job_id: str) -> asyncio.Queue:
+    """
+    Subscribe to field updates for a job. Returns once the process-wide
+    listener is subscribed; release the queue with unsubscribe_job().
+    """
+    global _listener
+    if _listener is None or _listener.done():
+        _listener = asyncio.create_task(_listen_job_events())
+    queue = asyncio.Queue()
+    _subscribers.setdefault(job_id, set()).add(queue)
+    try:
+        await asyncio.wait_for(_listening.wait(), EVENTS_KEEPALIVE)
+    except BaseException:
+        unsubscribe_job(job_id, queue)
+        raise
+    return queue
+
+
+def unsubscribe_job(job_id: str, queue: asyncio.Queue):
+    queues = _subscribers.get(job_id)
+    if queues is not None:
+        queues.discard(queue)
+        if not queues:
+            del _subscribers[job_id]
+
+
+async def close_job_events():
+    """Stop the listener and close its connection; for app shutdown."""
+    global _listener
+    if _listener is not None:
+        _listener.cancel()
+        try:
+            await _listener
+        except asyncio.CancelledError:
+            pass
+        _listener = None
+    await _events_redis_client.aclose()
+
+
+async def next_job_event(queue: asyncio.Queue) -> dict | None:
+    """
+    Wait for the next published field update. Returns None after
+    EVENTS_KEEPALIVE seconds without one so callers can send a keep-alive.
+    """
+    try:
+        return await asyncio.wait_for(queue.get(), EVENTS_KEEPALIVE)
+    except asyncio.TimeoutError:
+        return None
@@ -1,34 +1,59 @@
+import asyncio
+import io
+import shutil
+import struct
 import subprocess
 import uuid
+import wave
+from collections import deque
+from contextlib import asynccontextmanager
 from uuid import uuid4
 
-import requests
+import httpx
 from fastapi import FastAPI, Response, Request
 from fastapi import UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-import spacy
-from spacy.cli import download
-
-try:
-    nlp = spacy.load("en_core_web_sm")
-except OSError:
-    print("[INFO] Downloading spaCy model: en_core_web_sm")
-    download("en_core_web_sm")
-    nlp = spacy.load("en_core_web_sm")
-
 from starlette.staticfiles import StaticFiles
-from app.tasks import process_audio_job, download_book_task
+from app.tasks import audio_workflow, download_workflow
 from app.job_store import *
+from app import tts_cache, guess_cache, search_index, book_pack
+from app.segmenter import split_sentences, section_sentences
+
+VOICE_CLONE_URL = "http://voice-clone:5002/speak"  # Docker internal hostname
+VOICE_CLONE_TIMEOUT = float(os.getenv("VOICE_CLONE_TIMEOUT", 120))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Phases of a download workflow that is still running
+DOWNLOAD_ACTIVE_PHASES = {'downloading_list', 'downloaded_list', 'downloading_book',
+                          'downloaded_book', 'converting_book'}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled HTTP client for the voice-clone proxy, reused across requests
+    app.state.http_client = httpx.AsyncClient(
+        timeout=httpx.Timeout(VOICE_CLONE_TIMEOUT, connect=5.0),
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+    )
+    try:
+        await async_redis_client.ping()
+    except Exception as e:
+        print(f"[WARN] Redis not reachable at startup: {e}")
+    yield
+    await app.state.http_client.aclose()
+    await close_job_events()
+    await async_redis_client.aclose(close_connection_pool=True)
+
 
 # FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
   CORSMiddleware,
   allow_origins=["*"],
   allow_methods=["*"],
   allow_headers=["*"],
+  expose_headers=["ETag", "Content-Range", "Accept-Ranges"],
 )
 
 # Directories
@@ -50,7 +75,8 @@ async def catch_all_exceptions(request: Request, exc: Exception):
     )
 
 
-async def save_and_process_audio(file: UploadFile, job_id: str = None, is_clarification: bool = False):
+async def save_and_process_audio(file: UploadFile, job_id: str = None, is_clarification: bool = False,
+                                 bypass_cache: bool = False):
     """Common function to handle audio upload and processing"""
     job_id = job_id or str(uuid4())
 
@@ -64,13 +90,17 @@ async def save_and_process_audio(file: UploadFile, job_id: str = None, is_clarif
     filename = f"{unique_id}{extension}"
     file_path = os.path.join(UPLOAD_DIR, filename)
 
-    try:
-        contents = await file.read()
+    def write_upload():
+        # Copy the spooled upload to disk in chunks, off the event loop
         with open(file_path, 'wb') as f:
-            f.write(contents)
+            shutil.copyfileobj(file.file, f, UPLOAD_CHUNK_SIZE)
+            return f.tell()
+
+    try:
+        size = await asyncio.to_thread(write_upload)
 
         # Verify the file is not empty
-        if os.path.getsize(file_path) == 0:
+        if size == 0:
             raise HTTPException(status_code=400, detail="Empty audio file")
 
     except Exception as e:
@@ -79,31 +109,32 @@ async def save_and_process_audio(file: UploadFile, job_id: str = None, is_clarif
             detail=f"Failed to save audio file: {str(e)}"
         )
 
-    # Enqueue processing
-    async_result = process_audio_job.delay(job_id, filename)
-
+    # Write the job before enqueueing: a fast worker must neither find it
+    # missing nor have its updates wiped or overwritten by this write
     if is_clarification:
-        update_job(job_id, {
-            'phase': 'pending',
-            'task_id': async_result.id,
-        })
+        await async_update_job(job_id, {'phase': 'pending'})
     else:
-        save_job(job_id, {
+        await async_save_job(job_id, {
             'phase': 'pending',
-            'task_id': async_result.id,
+            'task_id': None,
             'result': None,
             'transcription': None,
             'history': [],
+            'bypass_cache': bypass_cache,
         })
 
+    # Enqueue the canvas itself rather than a task whose only job is to enqueue it
+    async_result = await asyncio.to_thread(audio_workflow(job_id, filename).apply_async)
+    await async_update_job(job_id, {'task_id': async_result.id})
+
     return job_id
 
 
 @app.post("/recognize")
-async def recognize_audio(file: UploadFile = File(...)):
+async def recognize_audio(file: UploadFile = File(...), bypass_cache: bool = False):
     """Endpoint for initial audio recognition"""
     try:
-        job_id = await save_and_process_audio(file)
+        job_id = await save_and_process_audio(file, bypass_cache=bypass_cache)
         return JSONResponse({
             'job_id': job_id,
             'status_url': f"/status/{job_id}"
@@ -119,7 +150,7 @@ async def recognize_audio(file: UploadFile = File(...)):
 
 @app.post("/answer_clarification/{job_id}")
 async def answer_clarification(job_id: str, file: UploadFile = File(...)):
-    if not get_job(job_id):
+    if not await async_get_job(job_id, include_history=False):
         raise HTTPException(status_code=404, detail="Job not found")
 
     try:
@@ -130,16 +161,25 @@ async def answer_clarification(job_id: str, file: UploadFile = File(...)):
 
 @app.post("/download_book/{job_id}")
 async def download_book(job_id: str):
-    job = get_job(job_id)
+    job = await async_get_job(job_id, include_history=False)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
 
-    async_result = download_book_task.delay(job_id)
+    if job.get('phase') in DOWNLOAD_ACTIVE_PHASES:
+        # Already on its way; a second workflow would only duplicate the IRC requests
+        return JSONResponse({
+            'job_id': job_id,
+            'status_url': f"/status/{job_id}"
+        })
 
-    update_job(job_id, {
-        'phase': 'downloading_list',
-        'task_id': async_result.id
-    })
+    # Set the phase first: a book already in the store converts instantly
+    await async_update_job(job_id, {'phase': 'downloading_list'})
+
+    # Building the canvas checks the book store on disk, so keep it off the loop
+    async_result = await asyncio.to_thread(
+        lambda: download_workflow(job_id, job.get('title'), job.get('author')).apply_async()
+    )
+    await async_update_job(job_id, {'task_id': async_result.id})
 
     return JSONResponse({
         'job_id': job_id,
@@ -154,29 +194,31 @@ class TTSRequest(BaseModel):
 SPEAKER_WAV = "app/voice_samples/your_sample.wav"
 MODEL_NAME = "tts_models/multilingual/multi-dataset/your_tts"
 
-def split_sentences(text: str) -> list[str]:
-    doc = nlp(text)
-    return [sent.text.strip() for sent in doc.sents]
-
-VOICE_CLONE_URL = "http://voice-clone:5002/speak"  # Docker internal hostname
-
 @app.post("/speak")
-async def speak(req: TTSRequest):
+async def speak(req: TTSRequest, request: Request):
     if not req.text:
         return JSONResponse(status_code=400, content={"error": "Missing 'text'"})
 
     if req.split:
-        sentences = split_sentences(req.text)
+        sentences = await asyncio.to_thread(split_sentences, req.text)
         return {"sentences": sentences}
 
+    cached = await asyncio.to_thread(tts_cache.lookup, req.text)
+    if cached is not None:
+        return Response(
+            content=cached,
+            media_type="audio/wav",
+            headers={"Content-Disposition": "inline; filename=output.wav", "X-TTS-Cache": "hit"}
+        )
+
     try:
-        response = requests.post(
+        response = await request.app.state.http_client.post(
             VOICE_CLONE_URL,
             json={"text": req.text}
         )
         if response.status_code != 200:
             raise HTTPException(status_code=502, detail="Voice synthesis failed: " + response.text)
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=f"Error contacting voice service: {str(e)}")
 
     return Response(
@@ -186,19 +228,275 @@ async def speak(req: TTSRequest):
     )
 
 
-@app.get("/status/{job_id}")
-async def get_status(job_id: str):
-    job = get_job(job_id)
-    if not job:
-        raise HTTPException(status_code=404, detail="Job not found")
+class TTSStreamRequest(BaseModel):
+    text: str | None = None
+    job_id: str | None = None
+    section: str | None = None
+    offset: int = 0
+
+# Sentences synthesized ahead of the one currently being streamed
+SPEAK_STREAM_LOOKAHEAD = int(os.getenv("SPEAK_STREAM_LOOKAHEAD", 2))
+
+def wav_stream_header(channels: int, sampwidth: int, framerate: int) -> bytes:
+    # Total length is unknown up front; 0xFFFFFFFF sizes tell players to read to EOF
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 0xFFFFFFFF, b'WAVE',
+        b'fmt ', 16, 1, channels, framerate,
+        framerate * channels * sampwidth, channels * sampwidth, sampwidth * 8,
+        b'data', 0xFFFFFFFF,
+    )
 
-    response = {
+async def synthesize_sentence(client: httpx.AsyncClient, sentence: str) -> bytes | None:
+    cached = await asyncio.to_thread(tts_cache.lookup, sentence)
+    if cached is not None:
+        return cached
+    try:
+        response = await client.post(VOICE_CLONE_URL, json={"text": sentence})
+    except httpx.HTTPError as e:
+        print(f"[ERROR] Error contacting voice service: {e}")
+        return None
+    if response.status_code != 200:
+        print(f"[ERROR] Voice synthesis failed: {response.text}")
+        return None
+    return response.content
+
+async def passage_sentences(req: TTSStreamRequest) -> list[str]:
+    if req.text:
+        return await asyncio.to_thread(split_sentences, req.text)
+    if not (req.job_id and req.section):
+        raise HTTPException(status_code=400, detail="Provide 'text' or 'job_id' and 'section'")
+    for part in (req.job_id, req.section):
+        # Both end up in a filesystem path; neither may leave BOOKS_DIR/<job>/parsed
+        if os.path.basename(part) != part or part in ('.', '..'):
+            raise HTTPException(status_code=400, detail="Invalid job id or section")
+
+    path = os.path.join(BOOKS_DIR, req.job_id, 'parsed', req.section)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Section not found")
+
+    # Precomputed at conversion time, so this is normally a small JSON read
+    return await asyncio.to_thread(section_sentences, path)
+
+async def stream_speech(client: httpx.AsyncClient, sentences: list[str]):
+    """
+    Yield one continuous WAV stream for the sentences, keeping up to
+    SPEAK_STREAM_LOOKAHEAD syntheses in flight behind the one being sent.
+    """
+    remaining = iter(sentences)
+    in_flight = deque()
+
+    def schedule():
+        for sentence in remaining:
+            if sentence:
+                in_flight.append(asyncio.create_task(synthesize_sentence(client, sentence)))
+                return
+
+    for _ in range(SPEAK_STREAM_LOOKAHEAD + 1):
+        schedule()
+
+    header_sent = False
+    try:
+        while in_flight:
+            content = await in_flight.popleft()
+            schedule()
+            if not content:
+                continue
+            with wave.open(io.BytesIO(content), 'rb') as clip:
+                if not header_sent:
+                    yield wav_stream_header(clip.getnchannels(), clip.getsampwidth(), clip.getframerate())
+                    header_sent = True
+                yield clip.readframes(clip.getnframes())
+    finally:
+        for task in in_flight:
+            task.cancel()
+
+async def speak_stream_response(req: TTSStreamRequest, request: Request) -> StreamingResponse:
+    sentences = await passage_sentences(req)
+    return StreamingResponse(
+        stream_speech(request.app.state.http_client, sentences[max(req.offset, 0):]),
+        media_type="audio/wav",
+        headers={"Content-Disposition": "inline; filename=speech.wav"}
+    )
+
+@app.get("/speak/cache")
+async def speak_cache_stats(request: Request):
+    """Hit/miss counters for this API process and the voice-clone service."""
+    stats = {'api': tts_cache.stats()}
+    try:
+        response = await request.app.state.http_client.get(VOICE_CLONE_URL.rsplit('/', 1)[0] + "/cache/stats")
+        stats['voice_clone'] = response.json()
+    except (httpx.HTTPError, ValueError) as e:
+        stats['voice_clone'] = {'error': str(e)}
+    return stats
+
+@app.get("/guess/cache")
+async def guess_cache_stats():
+    """Hit rate and size of the LLM guess cache."""
+    return await asyncio.to_thread(guess_cache.stats)
+
+@app.get("/search/cache")
+async def search_cache_stats():
+    """Hit rate and size of the local @search result index."""
+    return await asyncio.to_thread(search_index.stats)
+
+@app.post("/speak/stream")
+async def speak_stream(req: TTSStreamRequest, request: Request):
+    """Split a passage server-side and stream its speech as a single WAV."""
+    return await speak_stream_response(req, request)
+
+@app.get("/speak/stream")
+async def speak_stream_get(request: Request, text: str | None = None, job_id: str | None = None,
+                           section: str | None = None, offset: int = 0):
+    """GET form of /speak/stream so an <audio> element can play it directly."""
+    req = TTSStreamRequest(text=text, job_id=job_id, section=section, offset=offset)
+    return await speak_stream_response(req, request)
+
+
+STATUS_FIELDS = ('phase', 'transcription', 'guess', 'partial_guess', 'list', 'ebook_path',
+                 'download_bytes', 'download_total', 'download_rate', 'sections_ready')
+
+def status_payload(job_id: str, job: dict) -> dict:
+    return {
         'job_id': job_id,
         'phase': job.get('phase', 'unknown'),
         'transcription': job.get('transcription', ''),
         'guess': job.get('guess', ''),
+        'partial_guess': job.get('partial_guess'),
         'list': job.get('list', ''),
         'ebook_path': job.get('ebook_path', ''),
+        'download_bytes': job.get('download_bytes', 0),
+        'download_total': job.get('download_total', 0),
+        'download_rate': job.get('download_rate', 0),
+        'sections_ready': job.get('sections_ready', 0),
     }
 
-    return JSONResponse(response)
\ No newline at end of file
+
+async def packed_book(job_id: str) -> book_pack.PackedBook:
+    if os.path.basename(job_id) != job_id or job_id in ('.', '..'):
+        raise HTTPException(status_code=400, detail="Invalid job id")
+    book = await asyncio.to_thread(book_pack.open_packed, os.path.join(BOOKS_DIR, job_id, 'parsed'))
+    if book is None:
+        raise HTTPException(status_code=404, detail="No packed book for this job")
+    return book
+
+
+def parse_range(header: str, length: int) -> tuple[int, int] | None:
+    """
+    Resolve a single 'bytes=' range to (start, end) inclusive; None if it
+    can't be satisfied. Raises ValueError for anything invalid or
+    unsupported, which callers answer with the full body (RFC 9110 14.2).
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip() != 'bytes' or ',' in spec:
+        raise ValueError("Only single byte ranges are supported")
+    first, _, last = spec.strip().partition('-')
+    if not (first or last) or not all(p.isdigit() for p in (first, last) if p):
+        raise ValueError(f"Invalid byte range: {spec!r}")
+    if not first:
+        # Suffix range: the last N bytes
+        if int(last) == 0:
+            return None
+        start, end = max(length - int(last), 0), length - 1
+    else:
+        if last and int(last) < int(first):
+            raise ValueError(f"Invalid byte range: {spec!r}")
+        start, end = int(first), min(int(last), length - 1) if last else length - 1
+    if start >= length:
+        return None
+    return start, end
+
+
+@app.get("/books/{job_id}/sections")
+async def book_sections(job_id: str):
+    """Section titles, sizes and word counts of a packed book."""
+    book = await packed_book(job_id)
+    return {'etag': book.etag, 'sections': book.sections}
+
+
+@app.get("/books/{job_id}/sections/{n}")
+async def book_section(job_id: str, n: int, request: Request):
+    """
+    One section of a packed book, served as a slice of the memory-mapped
+    pack. Supports conditional requests (ETag) and single byte ranges.
+    """
+    book = await packed_book(job_id)
+    if not 0 <= n < len(book.sections):
+        raise HTTPException(status_code=404, detail="Section not found")
+
+    etag = f'"{book.etag}-{n}"'
+    headers = {'ETag': etag, 'Accept-Ranges': 'bytes', 'Cache-Control': 'public, max-age=86400'}
+    if_none_match = request.headers.get('if-none-match', '')
+    if if_none_match.strip() == '*' or etag in [t.strip() for t in if_none_match.split(',')]:
+        return Response(status_code=304, headers=headers)
+
+    view = book.section(n)
+    status = 200
+    range_header = request.headers.get('range')
+    if range_header and request.headers.get('if-range', etag) == etag:
+        try:
+            byte_range = parse_range(range_header, len(view))
+        except ValueError:
+            byte_range = (0, len(view) - 1)  # Invalid or unsupported: ignore it, send it all
+        if byte_range is None:
+            return Response(status_code=416, headers={**headers, 'Content-Range': f'bytes */{len(view)}'})
+        start, end = byte_range
+        if (start, end) != (0, len(view) - 1):
+            headers['Content-Range'] = f'bytes {start}-{end}/{len(view)}'
+            view = view[start:end + 1]
+            status = 206
+
+    headers['Content-Length'] = str(len(view))
+
+    async def body():
+        # A view into the mmap goes straight to the transport, no copy
+        if len(view):
+            yield view
+
+    return StreamingResponse(body(), status_code=status, headers=headers,
+                             media_type='text/plain; charset=utf-8')
+
+
+@app.get("/status/{job_id}")
+async def get_status(job_id: str):
+    job = await async_get_job(job_id, include_history=False)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return JSONResponse(status_payload(job_id, job))
+
+
+@app.get("/events/{job_id}")
+async def stream_events(job_id: str, request: Request):
+    """
+    Server-sent event stream of job status. Sends the current status once,
+    then every change the API or workers write to the job store.
+    """
+    # Subscribe before taking the snapshot so no update can slip between them
+    events = await subscribe_job(job_id)
+    job = await async_get_job(job_id, include_history=False)
+    if not job:
+        unsubscribe_job(job_id, events)
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def event_source():
+        state = status_payload(job_id, job)
+        try:
+            yield f"data: {json.dumps(state)}\n\n"
+            while not await request.is_disconnected():
+                update = await next_job_event(events)
+                if update is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                changed = {k: v for k, v in update.items() if k in STATUS_FIELDS}
+                if changed:
+                    state.update(changed)
+                    yield f"data: {json.dumps(state)}\n\n"
+        finally:
+            unsubscribe_job(job_id, events)
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
\ No newline at end of file
@@ -0,0 +1,145 @@
+# app/search_index.py
+"""
+Local index of earlier @search result lists. Each extracted list.txt is
+stored in an SQLite FTS5 table keyed on the normalized search terms, so a
+repeat search -- or a narrower one like the same title plus its author --
+is answered from disk instead of another IRC round trip.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+
+SEARCH_CACHE_ENABLED = os.getenv("SEARCH_CACHE", "1") == "1"
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", 24 * 3600))
+# Lives on the books volume so every worker (and the API's stats) sees it
+SEARCH_INDEX_PATH = os.getenv("SEARCH_INDEX_PATH", "/data/books/search_index.sqlite3")
+
+_local = threading.local()
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS searches (
+    id INTEGER PRIMARY KEY,
+    terms TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS searches_created ON searches (created);
+CREATE VIRTUAL TABLE IF NOT EXISTS results USING fts5 (
+    line,
+    search_id UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+def _connect() -> sqlite3.Connection:
+    # One connection per thread and process; prefork children get their own
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "pid", None) != os.getpid():
+        os.makedirs(os.path.dirname(SEARCH_INDEX_PATH), exist_ok=True)
+        conn = sqlite3.connect(SEARCH_INDEX_PATH, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        _local.conn, _local.pid = conn, os.getpid()
+    return conn
+
+
+def normalize_terms(title: str, author: str) -> list[str]:
+    """Lowercased, de-duplicated, sorted word tokens of a search."""
+    return sorted(set(re.findall(r"\w+", f"{title} {author}".lower())))
+
+
+def _bump(conn: sqlite3.Connection, name: str):
+    conn.execute(
+        "INSERT INTO stats (name, value) VALUES (?, 1) "
+        "ON CONFLICT (name) DO UPDATE SET value = value + 1",
+        (name,),
+    )
+
+
+def lookup(title: str, author: str) -> list[str] | None:
+    """
+    Result lines for a search, or None if no fresh search covers it.
+
+    An earlier search whose terms are a subset of these terms returned a
+    superset of the results (the search bots AND their terms), so filtering
+    its lines on every term gives the same answer a new search would.
+    """
+    terms = normalize_terms(title, author)
+    if not terms:
+        return None
+    conn = _connect()
+    with conn:
+        fresh = conn.execute(
+            "SELECT id, terms FROM searches WHERE created >= ? ORDER BY created DESC",
+            (time.time() - SEARCH_CACHE_TTL,),
+        ).fetchall()
+        wanted = set(terms)
+        covering = [sid for sid, stored in fresh if set(stored.split()) <= wanted]
+        if not covering:
+            _bump(conn, "misses")
+            return None
+
+        # Quoted terms so words like "and"/"not" aren't read as FTS operators
+        match = " ".join(f'"{t}"' for t in terms)
+        placeholders = ",".join("?" * len(covering))
+        rows = conn.execute(
+            f"SELECT DISTINCT line FROM results WHERE results MATCH ? "
+            f"AND search_id IN ({placeholders}) ORDER BY rowid",
+            (match, *covering),
+        ).fetchall()
+        # Nothing left after filtering: let the bots have a go rather than fail
+        _bump(conn, "hits" if rows else "misses")
+    if not rows:
+        return None
+    return [line for (line,) in rows]
+
+
+def add(title: str, author: str, list_path: str):
+    """Index the result list downloaded for a search and drop expired ones."""
+    terms = normalize_terms(title, author)
+    if not terms:
+        return
+    with open(list_path, encoding="utf-8", errors="replace") as f:
+        lines = [line.strip() for line in f if line.strip()]
+
+    conn = _connect()
+    with conn:
+        now = time.time()
+        expired = [sid for (sid,) in conn.execute(
+            "SELECT id FROM searches WHERE created < ?", (now - SEARCH_CACHE_TTL,)
+        )]
+        if expired:
+            placeholders = ",".join("?" * len(expired))
+            conn.execute(f"DELETE FROM results WHERE search_id IN ({placeholders})", expired)
+            conn.execute(f"DELETE FROM searches WHERE id IN ({placeholders})", expired)
+
+        search_id = conn.execute(
+            "INSERT INTO searches (terms, created) VALUES (?, ?)", (" ".join(terms), now)
+        ).lastrowid
+        conn.executemany(
+            "INSERT INTO results (line, search_id) VALUES (?, ?)",
+            ((line, search_id) for line in lines),
+        )
+
+
+def write_list(lines: list[str], list_path: str) -> str:
+    os.makedirs(os.path.dirname(list_path), exist_ok=True)
+    with open(list_path, "w", encoding="utf-8") as f:
+        f.writelines(f"{line}\n" for line in lines)
+    return list_path
+
+
+def stats() -> dict:
+    conn = _connect()
+    result = {name: value for name, value in conn.execute("SELECT name, value FROM stats")}
+    hits, misses = result.get("hits", 0), result.get("misses", 0)
+    result["hit_rate"] = hits / (hits + misses) if hits + misses else 0.0
+    result["searches"] = conn.execute(
+        "SELECT COUNT(*) FROM searches WHERE created >= ?", (time.time() - SEARCH_CACHE_TTL,)
+    ).fetchone()[0]
+    return result
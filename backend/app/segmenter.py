@@ -0,0 +1,101 @@
+# app/segmenter.py
+import json
+import os
+import re
+import tempfile
+from functools import lru_cache
+
+import spacy
+from spacy.cli import download
+
+# "senter" runs en_core_web_sm's statistical sentence recognizer with the
+# tagger/parser/NER excluded; "sentencizer" is a rule-based splitter that
+# needs no model at all.
+SEGMENTER = os.getenv("SEGMENTER", "senter").lower()
+PIPE_BATCH_SIZE = int(os.getenv("SEGMENTER_BATCH_SIZE", 64))
+SENTENCES_DIR = "sentences"
+
+_nlp = None
+
+
+def _load_senter():
+    # senter has its own embedding layer; the shared tok2vec would only feed
+    # the excluded tagger and parser
+    exclude = ["tok2vec", "parser", "tagger", "ner", "lemmatizer", "attribute_ruler"]
+    try:
+        nlp = spacy.load("en_core_web_sm", exclude=exclude)
+    except OSError:
+        print("[INFO] Downloading spaCy model: en_core_web_sm")
+        download("en_core_web_sm")
+        nlp = spacy.load("en_core_web_sm", exclude=exclude)
+    # senter ships disabled because the parser normally sets boundaries
+    nlp.enable_pipe("senter")
+    return nlp
+
+
+def _load_sentencizer():
+    nlp = spacy.blank("en")
+    nlp.add_pipe("sentencizer")
+    return nlp
+
+
+def get_nlp():
+    """Load the segmentation pipeline on first use instead of at import time."""
+    global _nlp
+    if _nlp is None:
+        _nlp = _load_sentencizer() if SEGMENTER == "sentencizer" else _load_senter()
+    return _nlp
+
+
+def split_sentences(text: str) -> list[str]:
+    """
+    Split text into sentences. Paragraphs are segmented as a batch with
+    nlp.pipe, which keeps each doc small and avoids nlp.max_length.
+    """
+    paragraphs = [p for p in re.split(r'\n\s*\n', text) if p.strip()]
+    sentences = []
+    for doc in get_nlp().pipe(paragraphs, batch_size=PIPE_BATCH_SIZE):
+        sentences.extend(s.text.strip() for s in doc.sents if s.text.strip())
+    return sentences
+
+
+def sentences_path(section_path: str) -> str:
+    parsed_dir, section = os.path.split(section_path)
+    stem = os.path.splitext(section)[0]
+    return os.path.join(parsed_dir, SENTENCES_DIR, f"{stem}.json")
+
+
+def segment_section(section_path: str) -> list[str]:
+    """Segment one section file and store the result next to it."""
+    with open(section_path, 'r', encoding='utf-8') as f:
+        sentences = split_sentences(f.read())
+
+    out_path = sentences_path(section_path)
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    # The conversion and the API's fallback may segment the same section at once
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(out_path), suffix=".part")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(sentences, f)
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return sentences
+
+
+@lru_cache(maxsize=256)
+def _cached_section_sentences(section_path: str, mtime: float) -> tuple[str, ...]:
+    try:
+        with open(sentences_path(section_path), 'r', encoding='utf-8') as f:
+            return tuple(json.load(f))
+    except (OSError, ValueError):
+        return tuple(segment_section(section_path))
+
+
+def section_sentences(section_path: str) -> list[str]:
+    """
+    Sentences for a converted section file: precomputed at conversion time,
+    memoized per file version, and segmented on demand only as a fallback.
+    """
+    return list(_cached_section_sentences(section_path, os.path.getmtime(section_path)))
@@ -6,83 +6,157 @@ from celery import chain
 import os
 from uuid import uuid4
 from app.workers.stt_worker import transcribe_audio_file
-from app.workers.llm_worker import query_llm_for_book
+from app.workers.llm_worker import query_llm_for_book, compact_history
 from app.workers.tts_worker import synthesize_speech
 from app.job_store import *
+from app import book_store, book_pack
+from app.book_index import read_index
 from fastapi import HTTPException
 
 # Directory where uploaded audio files are stored
 UPLOAD_DIR = '/data/audio/uploads'
 DATA_DIR = os.getenv('DATA_DIR', '/data')
+# How many leading sections get audio rendered ahead of time
+PRERENDER_SECTIONS = int(os.getenv('PRERENDER_SECTIONS', 3))
+# Transcribe and guess in one task (one hop, no second task pickup) instead of a chain
+FUSED_TURN = os.getenv('FUSED_TURN', '1') == '1'
+# How many of the best-ranked search results the download may fall back to
+DOWNLOAD_CANDIDATES = int(os.getenv('DOWNLOAD_CANDIDATES', 3))
+
+
+def audio_workflow(job_id: str, filename: str):
+    """Canvas for one audio turn, for the API to enqueue directly."""
+    filepath = os.path.join(UPLOAD_DIR, filename)
+    if FUSED_TURN:
+        return process_turn.s(job_id, filepath)
+    return chain(
+        transcribe_audio.s(job_id, filepath),
+        guess_book.s()
+    )
+
+
+def download_workflow(job_id: str, title: str, author: str):
+    """Canvas for downloading, converting and pre-rendering the guessed book."""
+    stored = book_store.find_converted(title, author)
+    if stored:
+        # Someone already fetched and converted this book; just link it
+        return chain(
+            link_stored_book.s(job_id, stored),
+            prerender_book_audio.s()
+        )
+    return chain(
+        download_list_task.s(title, author, job_id),
+        actually_download_book.s(),
+        convert_book_task.s(),
+        prerender_book_audio.s()
+    )
+
 
 @celery_app.task(bind=True)
 def process_audio_job(self, job_id: str, filename: str):
     """
     Phase 1: Transcribe and make first guess.
+    Kept for messages queued before the API enqueued audio_workflow itself.
     """
-    filepath = os.path.join(UPLOAD_DIR, filename)
-    workflow = chain(
-        transcribe_audio.s(job_id, filepath),
-        guess_book.s()
-    )
-    result = workflow.apply_async()
+    result = audio_workflow(job_id, filename).apply_async()
 
     return {'workflow_id': result.id, 'job_id': job_id}
 
-@celery_app.task(bind=True)
-def transcribe_audio(self, job_id: str, filepath: str) -> dict:
-    """Run speech-to-text on the uploaded audio file."""
-    transcript = transcribe_audio_file(filepath)
 
-    # Load the existing job so we can preserve existing history
-    job = get_job(job_id)
-    history = job.get('history', [])
+def _transcribe(filepath: str) -> str:
+    try:
+        return transcribe_audio_file(filepath)
+    finally:
+        # The upload is only needed for this one transcription
+        if os.path.exists(filepath):
+            os.remove(filepath)
 
-    # Add the user's transcript to history
-    history.append({"role": "user", "content": transcript})
 
-    # Update the job
-    update_job(job_id, {
+@celery_app.task(bind=True, ignore_result=True)
+def transcribe_audio(self, job_id: str, filepath: str) -> dict:
+    """Run speech-to-text on the uploaded audio file."""
+    transcript = _transcribe(filepath)
+
+    # Append the user's transcript to history and update the job atomically
+    append_history(job_id, [{"role": "user", "content": transcript}], {
         'transcription': transcript,
-        'history': history,
         'phase': 'transcribed'
     })
     return {'job_id': job_id, 'transcription': transcript}
 
 
-@celery_app.task(bind=True)
-def guess_book(self, previous_result: dict) -> dict:
-    job_id = previous_result["job_id"]
-    job    = get_job(job_id)
-    history = job.get("history", [])
+def _guess(job_id: str, pending: list) -> tuple[dict, list, dict]:
+    """
+    Ask the LLM for a guess. pending holds messages that belong to this turn
+    but are not stored yet. Returns (guess, messages to append, job fields).
+    """
+    job = get_job(job_id, include_history=False)
+
+    # Only the turns after the stored summary are read and sent verbatim
+    summary = job.get("history_summary")
+    recent = get_history(job_id, start=summary["covered"] if summary else 0) + pending
+    new_summary, history = compact_history(summary, recent)
+
+    def publish_partial(partial: dict):
+        # Lets the UI show the question (or title) before the reply finishes
+        update_job(job_id, {"partial_guess": partial, "phase": "guessing"})
 
     # This returns a dict like {"status":"need_clarification","question": "..."}
-    guess_obj = query_llm_for_book(history)
+    guess_obj = query_llm_for_book(history, on_partial=publish_partial,
+                                   use_cache=not job.get("bypass_cache"))
+
+    fields = {
+      "guess":   guess_obj,
+      "partial_guess": None,
+      "phase":   "guessed"
+    }
+    if new_summary is not summary:
+        fields["history_summary"] = new_summary
 
     # Turn that into a string for the assistant message
     if guess_obj.get("status") == "need_clarification":
         assistant_content = guess_obj["question"]
     elif guess_obj.get("status") == "confident":
         assistant_content = f"\"{guess_obj['title']}\" by {guess_obj['author']}"
-        update_job(job_id, {
+        fields.update({
             "title": guess_obj["title"],
             "author": guess_obj["author"]
         })
     else:
         assistant_content = str(guess_obj)
 
-    # Append a proper string message
-    history.append({
+    messages = pending + [{
       "role": "assistant",
       "content": assistant_content
-    })
+    }]
+    return guess_obj, messages, fields
 
-    # Save both the raw object and the updated history
-    update_job(job_id, {
-      "guess":   guess_obj,
-      "history": history,
-      "phase":   "guessed"
+
+@celery_app.task(bind=True)
+def guess_book(self, previous_result: dict) -> dict:
+    job_id = previous_result["job_id"]
+    guess_obj, messages, fields = _guess(job_id, [])
+
+    # Append a proper string message and save the raw object in one write
+    append_history(job_id, messages, fields)
+
+    return {"job_id": job_id, "guess": guess_obj}
+
+
+@celery_app.task(bind=True)
+def process_turn(self, job_id: str, filepath: str) -> dict:
+    """
+    Transcribe and guess in one task. The user's message is stored and
+    shown as soon as it exists, so a failed guess never loses it.
+    """
+    transcript = _transcribe(filepath)
+    append_history(job_id, [{"role": "user", "content": transcript}], {
+        'transcription': transcript,
+        'phase': 'transcribed'
     })
+    guess_obj, messages, fields = _guess(job_id, [])
+
+    append_history(job_id, messages, fields)
 
     return {"job_id": job_id, "guess": guess_obj}
 
@@ -90,50 +164,131 @@ def guess_book(self, previous_result: dict) -> dict:
 @celery_app.task(bind=True)
 def download_book_task(self, job_id: str):
     """
-    Phase 1: Transcribe and make first guess.
+    Phase 2: Download and convert the guessed book.
+    Kept for messages queued before the API enqueued download_workflow itself.
     """
-    job = get_job(job_id)
-    workflow = chain(
-        download_list_task.s(job.get('title'), job.get('author'), job_id),
-        actually_download_book.s(),
-        convert_book_task.s()
-    )
-    result = workflow.apply_async()
+    job = get_job(job_id, include_history=False)
+    result = download_workflow(job_id, job.get('title'), job.get('author')).apply_async()
 
     return {'workflow_id': result.id, 'job_id': job_id}
 
-@celery_app.task(bind=True)
+def _workflow_id(task) -> str:
+    # Every task of one download chain, redeliveries included, shares the root id
+    return task.request.root_id or task.request.id
+
+def _claim_or_wait_download(owner: str, title: str, author: str) -> dict | None:
+    """
+    Claim the download of a guess for the workflow owner, or follow the
+    workflow that holds the claim. Returns that workflow's stored book, or
+    None once owner holds the claim.
+    """
+    if not title:
+        return None
+    # Downloaded already, though its conversion may still be running
+    stored = book_store.find_stored(title, author)
+    if stored:
+        return stored
+    while not book_store.claim_download(title, author, owner):
+        print(f"[DEBUG] Another workflow is downloading '{title}'; waiting for it")
+        stored = book_store.wait_download(title, author)
+        if stored:
+            return stored
+    return None
+
+@celery_app.task(bind=True, ignore_result=True)
 def download_list_task(self, title: str, author: str, job_id: str):
-    job = get_job(job_id)
-    from app.workers.irc_worker import download_list
-    path = download_list(title, author, job_id)
-    print(f"[DEBUG] List downloaded to {path}")
+    # Concurrent requests for one book share a single IRC download
+    owner = _workflow_id(self)
+    stored = _claim_or_wait_download(owner, title, author)
+    if stored:
+        return {'job_id': job_id, 'stored': stored}
+    try:
+        return _download_list(title, author, job_id)
+    except Exception:
+        book_store.release_download(title, author, owner)
+        raise
+
+def _download_list(title: str, author: str, job_id: str) -> dict:
+    from app import search_index
+    lines = search_index.lookup(title, author) if search_index.SEARCH_CACHE_ENABLED else None
+    if lines:
+        # An earlier search already covers this one; skip the IRC round trip
+        path = search_index.write_list(lines, f'/data/books/{job_id}/list.txt')
+        print(f"[DEBUG] List served from search index: {len(lines)} results")
+    else:
+        from app.workers.irc_worker import download_list
+        path = download_list(title, author, job_id)
+        print(f"[DEBUG] List downloaded to {path}")
+        try:
+            search_index.add(title, author, path)
+        except Exception as e:
+            # The index is only an accelerator; never fail the download over it
+            print(f"[ERROR] Indexing search results failed: {e}")
     update_job(job_id, {
         "phase": "downloaded_list",
         "list": path,
     })
     return {'path': path, 'job_id': job_id}
 
-@celery_app.task(bind=True)
+@celery_app.task(bind=True, ignore_result=True)
 def actually_download_book(self, prev: dict) -> dict:
     """Fetch the guessed book via IRC."""
     job_id: str = prev.get('job_id')
+    if prev.get('stored'):
+        # Fetched by another job for the same guess; convert_book_task shares its conversion too
+        stored = prev['stored']
+        path = book_store.link_job(job_id, stored)
+        update_job(job_id, {
+            "phase": "downloaded_book",
+            "ebook_path": path,
+            "book_sha256": stored['sha256'],
+        })
+        return {'job_id': job_id, 'ebook_path': path, 'stored': stored}
+
     list_path: str = prev.get('path')
     update_job(job_id, {
         "phase": "downloading_book"
     })
-    from app.workers.select_worker import parse_and_sort
-    query: str = parse_and_sort(list_path)[0]['original_line']
-    from app.workers.irc_worker import download_book
-    path = download_book(query, job_id)
+    job = get_job(job_id, include_history=False)
+    try:
+        return _download_book(job_id, job, list_path)
+    finally:
+        # Waiting jobs find the ingested book, or take over the claim on failure
+        book_store.release_download(job.get('title', ''), job.get('author', ''), _workflow_id(self))
+
+def _download_book(job_id: str, job: dict, list_path: str) -> dict:
+    from app.workers.select_worker import parse_and_sort, record_bot_result
+    # Candidates race into the same job directory, so only the best offer of each filename
+    candidates = []
+    filenames = set()
+    for entry in parse_and_sort(list_path, job.get('title', ''), job.get('author', '')):
+        if entry['filename'].lower() not in filenames:
+            filenames.add(entry['filename'].lower())
+            candidates.append(entry)
+            if len(candidates) == DOWNLOAD_CANDIDATES:
+                break
+    if not candidates:
+        raise RuntimeError(f"No usable entries in {list_path}")
+    bots = {c['original_line']: c['bot'] for c in candidates}
+
+    def on_failure(query: str, error: str):
+        print(f"[DEBUG] Candidate failed: {query}: {error}")
+        record_bot_result(bots[query], ok=False)
+
+    from app.workers.irc_worker import download_first
+    path, query = download_first(list(bots), job_id, on_failure)
+    record_bot_result(bots[query], ok=True)
     print(f"[DEBUG] Book downloaded to {path}")
+    # Identical bytes fetched by another job are shared, not stored twice
+    stored = book_store.ingest(path, job.get('title', ''), job.get('author', ''))
     update_job(job_id, {
         "phase": "downloaded_book",
-        "ebook_path": path
+        "ebook_path": path,
+        "book_sha256": stored['sha256'],
     })
-    return {'job_id': job_id, 'ebook_path': path}
+    return {'job_id': job_id, 'ebook_path': path, 'stored': stored}
 
-@celery_app.task(bind=True)
+@celery_app.task(bind=True, ignore_result=True)
 def convert_book_task(self, prev: dict):
     """Convert the downloaded book to txt files"""
     job_id: str = prev.get('job_id')
@@ -142,12 +297,62 @@ def convert_book_task(self, prev: dict):
         "phase": "converting_book"
     })
     from app.workers.convert_worker import convert_ebook
-    convert_ebook(ebook_path, f'/data/books/{job_id}/parsed')
+    from app.segmenter import segment_section
+
+    def report_sections(count: int):
+        update_job(job_id, {"sections_ready": count})
+
+    def convert(parsed_dir: str):
+        def on_section(filename: str, count: int):
+            report_sections(count)
+            # Segment as we go so reading or pre-rendering never re-runs spaCy
+            try:
+                segment_section(os.path.join(parsed_dir, filename))
+            except Exception as e:
+                # Never fail the conversion over it; section_sentences segments on demand
+                print(f"[ERROR] Segmenting {filename} failed: {e}")
+        convert_ebook(ebook_path, parsed_dir, on_section)
+        if book_pack.PACK_BOOKS:
+            book_pack.pack_book(parsed_dir)
+
+    stored = prev.get('stored')
+    if stored is None:
+        # Queued before downloads went through the book store
+        convert(f'/data/books/{job_id}/parsed')
+    else:
+        sha = stored['sha256']
+        # Linked up front so the viewer can open sections as they appear
+        book_store.link_job(job_id, stored)
+        while not book_store.is_converted(sha):
+            if book_store.claim_conversion(sha):
+                try:
+                    convert(book_store.parsed_dir(sha))
+                except Exception:
+                    book_store.release_conversion(sha)
+                    raise
+                break
+            # Another job is converting the same file; follow its progress
+            book_store.wait_converted(sha, report_sections)
     update_job(job_id, {
         "phase": "converted_book"
     })
     return {'job_id': job_id}
 
+@celery_app.task(bind=True, ignore_result=True)
+def link_stored_book(self, job_id: str, stored: dict) -> dict:
+    """Give a job an already converted book from the shared store."""
+    ebook_path = book_store.link_job(job_id, stored)
+    parsed_dir = book_store.parsed_dir(stored['sha256'])
+    if book_pack.PACK_BOOKS and not os.path.exists(os.path.join(parsed_dir, book_pack.PACK_INDEX_NAME)):
+        # Converted before packing existed
+        book_pack.pack_book(parsed_dir)
+    update_job(job_id, {
+        "phase": "converted_book",
+        "ebook_path": ebook_path,
+        "book_sha256": stored['sha256'],
+    })
+    return {'job_id': job_id}
+
 @celery_app.task(bind=True)
 def speak_text(self, previous_result: dict) -> dict:
     """Synthesize speech from extracted text."""
@@ -155,3 +360,26 @@ def speak_text(self, previous_result: dict) -> dict:
     text_path = previous_result.get('text_path')
     audio_path = synthesize_speech(text_path, DATA_DIR)
     return {'job_id': job_id, 'audio_path': audio_path}
+
+@celery_app.task(bind=True)
+def prerender_book_audio(self, prev: dict) -> dict:
+    """Pre-synthesize the first sections of a converted book in the background."""
+    job_id: str = prev.get('job_id')
+    parsed_dir = f'/data/books/{job_id}/parsed'
+    audio_dir = f'/data/books/{job_id}/audio'
+
+    sections = read_index(parsed_dir)[0][:PRERENDER_SECTIONS]
+
+    rendered = []
+    for section in sections:
+        try:
+            audio_path = synthesize_speech(os.path.join(parsed_dir, section), audio_dir)
+        except Exception as e:
+            # A failed section just falls back to live synthesis at read time
+            print(f"[ERROR] Pre-rendering {section} failed: {e}")
+            continue
+        if audio_path:
+            rendered.append(section)
+            update_job(job_id, {"audio_sections": rendered})
+
+    return {'job_id': job_id, 'audio_sections': rendered}
@@ -0,0 +1,62 @@
+# app/tts_cache.py
+"""
+Read side of the voice-clone service's on-disk audio cache. Both services
+mount the same directory; the voice-clone service writes and evicts, the
+API only looks clips up so repeated sentences skip the proxy hop entirely.
+"""
+import hashlib
+import json
+import os
+import threading
+
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "/data/tts_cache")
+MANIFEST_NAME = "voice.json"
+
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+_voice = {"mtime": None, "data": None}
+
+
+def cache_key(text: str, model: str, speaker: str, language: str) -> str:
+    # Must match voice-clone/app/tts_cache.py
+    payload = json.dumps([text.strip(), model, speaker, language])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _load_voice() -> dict | None:
+    """Return the current voice manifest, re-reading it only when it changes."""
+    path = os.path.join(TTS_CACHE_DIR, MANIFEST_NAME)
+    try:
+        mtime = os.path.getmtime(path)
+        if mtime != _voice["mtime"]:
+            with open(path) as f:
+                _voice["data"] = json.load(f)
+            _voice["mtime"] = mtime
+    except (OSError, ValueError):
+        return None
+    return _voice["data"]
+
+
+def lookup(text: str) -> bytes | None:
+    """Return cached WAV bytes for text, or None on a miss."""
+    voice = _load_voice()
+    data = None
+    if voice:
+        key = cache_key(text, voice["model"], voice["speaker"], voice["language"])
+        path = os.path.join(TTS_CACHE_DIR, key[:2], f"{key}.wav")
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # Keep the entry warm in the writer's mtime-based LRU order
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    with _lock:
+        _stats["hits" if data is not None else "misses"] += 1
+    return data
+
+
+def stats() -> dict:
+    with _lock:
+        return dict(_stats)
@@ -1,23 +1,61 @@
-import json
+import multiprocessing
+import queue
+import shutil
+import threading
 import zipfile
 import rarfile
 import tempfile
 from ebooklib import epub, ITEM_DOCUMENT
-from bs4 import BeautifulSoup
+from lxml import etree
 from abc import ABC, abstractmethod
+from collections import deque
 import os
 import re
 import mobi
-from io import StringIO
+from io import BytesIO, StringIO
 from pdfminer.high_level import extract_text_to_fp
 from pdfminer.layout import LAParams
 import PyPDF2
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from app.book_index import write_index
+
+# Processes a PDF is split across, and pages handed to each at a time
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", os.cpu_count() or 1))
+PDF_SHARD_PAGES = int(os.getenv("PDF_SHARD_PAGES", 20))
+# The pool is started from threaded workers (Celery -P threads, archive
+# members), and forking a multi-threaded process can leave locks held in
+# the child; pool processes come from a clean forkserver instead
+_PDF_POOL_CONTEXT = multiprocessing.get_context("forkserver")
+# Bytes of HTML fed to the parser at a time
+HTML_CHUNK_SIZE = 64 * 1024
+# Archive members converted at the same time
+ARCHIVE_WORKERS = int(os.getenv("ARCHIVE_WORKERS", 4))
+# Formats worth converting inside an archive, best first; when a book is
+# there in several formats only the best one is converted
+ARCHIVE_MEMBER_PRIORITY = {'.epub': 0, '.mobi': 1, '.azw3': 1, '.pdf': 2, '.txt': 3}
+
+# Elements that end a paragraph, and ones whose text is never shown
+_BLOCK_TAGS = frozenset({
+    'address', 'article', 'aside', 'blockquote', 'dd', 'div', 'dl', 'dt',
+    'figcaption', 'figure', 'footer', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'header', 'hr', 'li', 'ol', 'p', 'pre', 'section', 'table', 'td', 'th',
+    'tr', 'ul',
+})
+_SKIP_TAGS = frozenset({'script', 'style', 'noscript', 'svg'})
+_TITLE_TAGS = ('h1', 'h2')
 
 
 class Converter(ABC):
+    # Whether iter_sections also takes a binary file object instead of a path
+    reads_streams = False
+
     @abstractmethod
+    def iter_sections(self, input_path, output_dir):
+        """Write section files to output_dir, yielding each filename once it is written."""
+
     def convert(self, input_path, output_dir):
-        pass
+        for _ in self.iter_sections(input_path, output_dir):
+            pass
 
 
 def slugify(text):
@@ -25,8 +63,118 @@ def slugify(text):
     return re.sub(r'[^a-zA-Z0-9]+', '_', text).strip('_').lower()
 
 
+class _HtmlSectionTarget:
+    """
+    lxml parser target that sees each tag and text node exactly once, in
+    document order, without building a tree. Text is gathered into the
+    current section; every heading in split_tags starts a new one.
+    """
+
+    def __init__(self, split_tags):
+        self.split_tags = split_tags
+        self.sections = deque()
+        self.parts = []
+        self.section_title = None
+        self.heading = None
+        self.first_heading = None
+        self.doc_title = None
+        self.in_title = False
+        self.skip_depth = 0
+        self.pre_depth = 0
+
+    def _flush(self):
+        text = ''.join(self.parts)
+        text = re.sub(r'[^\S\n]+', ' ', text)
+        text = re.sub(r' *\n *', '\n', text)
+        text = re.sub(r'\n{3,}', '\n\n', text).strip()
+        if text:
+            self.sections.append((self.section_title, text))
+        self.parts = []
+
+    def start(self, tag, attrib):
+        if tag in _SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag == 'title':
+            self.in_title = True
+            self.doc_title = ''
+        elif tag in self.split_tags:
+            self._flush()
+            self.heading = []
+        elif tag in _TITLE_TAGS and self.first_heading is None:
+            self.heading = []
+        if tag == 'br':
+            self.parts.append('\n')
+        elif tag in _BLOCK_TAGS:
+            self.parts.append('\n\n')
+        if tag == 'pre':
+            self.pre_depth += 1
+
+    def end(self, tag):
+        if tag in _SKIP_TAGS:
+            self.skip_depth -= 1
+        elif tag == 'title':
+            self.in_title = False
+        elif self.heading is not None and (tag in self.split_tags or tag in _TITLE_TAGS):
+            heading = ' '.join(''.join(self.heading).split())
+            if self.first_heading is None:
+                self.first_heading = heading
+            if tag in self.split_tags:
+                self.section_title = heading
+            self.heading = None
+        if tag in _BLOCK_TAGS:
+            self.parts.append('\n\n')
+        if tag == 'pre':
+            self.pre_depth -= 1
+
+    def data(self, data):
+        if self.skip_depth:
+            return
+        if self.in_title:
+            self.doc_title += data
+            return
+        if self.heading is not None:
+            self.heading.append(data)
+            if self.split_tags:
+                # Split headings become the section title, not its text
+                return
+        # Source line breaks are just whitespace in HTML, except inside <pre>
+        self.parts.append(data if self.pre_depth else data.replace('\n', ' '))
+
+    def close(self):
+        self._flush()
+
+
+def iter_html_sections(chunks, split_tags=()):
+    """
+    Single streaming pass over HTML given as byte chunks, yielding
+    (title, text) for each section as soon as it is complete. With no
+    split_tags the whole document is one section titled by its first
+    h1/h2 or <title>. Memory stays at one section plus the parser buffer.
+    """
+    target = _HtmlSectionTarget(frozenset(split_tags))
+    parser = etree.HTMLParser(target=target, encoding='utf-8', recover=True,
+                              remove_comments=True, remove_pis=True)
+    for chunk in chunks:
+        parser.feed(chunk)
+        while target.sections:
+            yield target.sections.popleft()
+    parser.close()
+
+    if not split_tags and target.sections:
+        _, text = target.sections.popleft()
+        yield target.first_heading or (target.doc_title or '').strip() or None, text
+    while target.sections:
+        yield target.sections.popleft()
+
+
+def _read_chunks(path, chunk_size=HTML_CHUNK_SIZE):
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
 class EpubConverter(Converter):
-    def convert(self, input_path, output_dir):
+    def iter_sections(self, input_path, output_dir):
         """Convert EPUB file to individual text files per section."""
         book = epub.read_epub(input_path)
         os.makedirs(output_dir, exist_ok=True)
@@ -35,24 +183,20 @@ class EpubConverter(Converter):
 
         for item in book.get_items():
             if item.get_type() == ITEM_DOCUMENT:
-                soup = BeautifulSoup(item.get_content(), 'html.parser')
-
-                # Use <h1>, <h2>, or title fallback
-                title_tag = soup.find(['h1', 'h2']) or soup.title
-                title = title_tag.get_text(strip=True) if title_tag else f'section_{file_count}'
-                filename = f"{file_count:03d}_{slugify(title)}.txt"
-
-                # Extract plain text from the HTML
-                text = soup.get_text(separator="\n")
+                # One section per document, titled by <h1>, <h2>, or <title>
+                for title, text in iter_html_sections([item.get_content()]):
+                    title = title or f'section_{file_count}'
+                    filename = f"{file_count:03d}_{slugify(title)}.txt"
 
-                with open(os.path.join(output_dir, filename), 'w', encoding='utf-8') as f:
-                    f.write(text.strip())
+                    with open(os.path.join(output_dir, filename), 'w', encoding='utf-8') as f:
+                        f.write(text)
+                    yield filename
 
-                file_count += 1
+                    file_count += 1
 
 
 class MobiConverter(Converter):
-    def convert(self, input_path, output_dir):
+    def iter_sections(self, input_path, output_dir):
         """Convert MOBI file to individual text files per section."""
         # Extract MOBI content
         temp_dir, filepath = mobi.extract(input_path)
@@ -60,68 +204,104 @@ class MobiConverter(Converter):
         # MOBI files are often converted to HTML during extraction
         # So we'll treat them similarly to EPUBs
         try:
+            os.makedirs(output_dir, exist_ok=True)
+            file_count = 0
             # Try to find the HTML file in the extracted directory
             for root, _, files in os.walk(temp_dir):
-                for file in files:
+                for file in sorted(files):
                     if file.endswith('.html') or file.endswith('.htm'):
                         html_path = os.path.join(root, file)
-                        with open(html_path, 'r', encoding='utf-8') as f:
-                            soup = BeautifulSoup(f.read(), 'html.parser')
-
-                        sections = self._split_into_sections(soup)
-                        os.makedirs(output_dir, exist_ok=True)
-
-                        for i, (title, content) in enumerate(sections):
-                            filename = f"{i:03d}_{slugify(title)}.txt"
+                        # Streamed from disk: one heading-delimited section at a time
+                        for title, content in iter_html_sections(_read_chunks(html_path), ('h1', 'h2', 'h3')):
+                            filename = f"{file_count:03d}_{slugify(title or 'Section')}.txt"
                             with open(os.path.join(output_dir, filename), 'w', encoding='utf-8') as f:
-                                f.write(content.strip())
+                                f.write(content)
+                            yield filename
+                            file_count += 1
         finally:
             mobi.cleanup(temp_dir)
 
-    def _split_into_sections(self, soup):
-        """Split HTML content into sections based on headings."""
-        sections = []
-        current_title = "Section"
-        current_content = []
-
-        for element in soup.find_all(True):
-            if element.name in ['h1', 'h2', 'h3']:
-                if current_content:
-                    sections.append((current_title, '\n'.join(current_content)))
-                    current_content = []
-                current_title = element.get_text(strip=True)
-            else:
-                text = element.get_text(separator='\n', strip=True)
-                if text:
-                    current_content.append(text)
 
-        if current_content:
-            sections.append((current_title, '\n'.join(current_content)))
+def _pdfminer_page_text(input_path, page_number):
+    """Extract a single page with pdfminer, for pages PyPDF2 can't handle."""
+    output_string = StringIO()
+    with open(input_path, 'rb') as f:
+        extract_text_to_fp(f, output_string, laparams=LAParams(), page_numbers=[page_number])
+    return output_string.getvalue()
+
 
-        return sections if sections else [("content", soup.get_text(separator='\n'))]
+def _convert_pdf_pages(input_path, output_dir, start, stop, width):
+    """
+    Write pages [start, stop) of a PDF as one section file each. Runs in a
+    pool process, so it opens its own reader. Returns (filenames written,
+    number of pages that needed the pdfminer fallback).
+    """
+    written = []
+    fallbacks = 0
+    with open(input_path, 'rb') as f:
+        reader = PyPDF2.PdfReader(f)
+        for i in range(start, stop):
+            try:
+                text = reader.pages[i].extract_text() or ''
+            except Exception:
+                fallbacks += 1
+                try:
+                    text = _pdfminer_page_text(input_path, i)
+                except Exception as e:
+                    print(f"[!] Skipping unreadable PDF page {i + 1}: {e}")
+                    continue
+            if text.strip():
+                filename = f"{i:0{width}d}_page_{i + 1}.txt"
+                with open(os.path.join(output_dir, filename), 'w', encoding='utf-8') as f_out:
+                    f_out.write(text.strip())
+                written.append(filename)
+    return written, fallbacks
 
 
 class PdfConverter(Converter):
-    def convert(self, input_path, output_dir):
-        """Convert PDF file to individual text files per section."""
+    def __init__(self, workers=None):
+        self.workers = workers or PDF_WORKERS
+
+    def iter_sections(self, input_path, output_dir):
+        """Convert PDF file to individual text files per page, sharded across processes."""
         os.makedirs(output_dir, exist_ok=True)
 
-        # First approach: Try to extract text with structure
         try:
             with open(input_path, 'rb') as f:
-                reader = PyPDF2.PdfReader(f)
-
-                for i, page in enumerate(reader.pages):
-                    text = page.extract_text()
-                    if text.strip():
-                        filename = f"{i:03d}_page_{i + 1}.txt"
-                        with open(os.path.join(output_dir, filename), 'w', encoding='utf-8') as f_out:
-                            f_out.write(text.strip())
-            return
+                page_count = len(PyPDF2.PdfReader(f).pages)
         except Exception:
-            pass
+            page_count = 0
+        if not page_count:
+            # PyPDF2 can't even read the structure; let pdfminer take the whole file
+            yield from self._convert_with_pdfminer(input_path, output_dir)
+            return
 
-        # Fallback: Use pdfminer for more complex PDFs
+        # Zero-padded wide enough that index.json's sort keeps page order
+        width = max(3, len(str(page_count - 1)))
+        shards = [(start, min(start + PDF_SHARD_PAGES, page_count))
+                  for start in range(0, page_count, PDF_SHARD_PAGES)]
+        workers = min(self.workers, len(shards))
+
+        fallbacks = 0
+        # Daemonic processes (e.g. prefork Celery children) can't start a pool
+        if workers > 1 and not multiprocessing.current_process().daemon:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=_PDF_POOL_CONTEXT) as pool:
+                futures = [pool.submit(_convert_pdf_pages, input_path, output_dir, start, stop, width)
+                           for start, stop in shards]
+                # In page order, so the readable part of the book grows from the front
+                for future in futures:
+                    written, shard_fallbacks = future.result()
+                    fallbacks += shard_fallbacks
+                    yield from written
+        else:
+            for start, stop in shards:
+                written, shard_fallbacks = _convert_pdf_pages(input_path, output_dir, start, stop, width)
+                fallbacks += shard_fallbacks
+                yield from written
+        if fallbacks:
+            print(f"[*] {fallbacks} of {page_count} PDF pages used the pdfminer fallback")
+
+    def _convert_with_pdfminer(self, input_path, output_dir):
         output_string = StringIO()
         laparams = LAParams()
 
@@ -135,6 +315,7 @@ class PdfConverter(Converter):
             filename = f"{i:03d}_{slugify(title)}.txt"
             with open(os.path.join(output_dir, filename), 'w', encoding='utf-8') as f:
                 f.write(content.strip())
+            yield filename
 
     def _split_pdf_into_sections(self, text):
         """Attempt to split PDF text into sections based on common patterns."""
@@ -162,12 +343,17 @@ class PdfConverter(Converter):
 
 
 class TextConverter(Converter):
-    def convert(self, input_path, output_dir):
+    reads_streams = True
+
+    def iter_sections(self, input_path, output_dir):
         """Convert plain text file to individual files based on sections."""
         os.makedirs(output_dir, exist_ok=True)
 
-        with open(input_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+        if isinstance(input_path, str):
+            with open(input_path, 'r', encoding='utf-8') as f:
+                content = f.read()
+        else:
+            content = input_path.read().decode('utf-8', errors='replace')
 
         # Split on multiple newlines or common chapter markers
         sections = re.split(r'\n\s*\n|\nCHAPTER [IVXLCDM0-9]+\n', content)
@@ -186,50 +372,114 @@ class TextConverter(Converter):
                 filename = f"{i:03d}_{slugify(title)}.txt"
                 with open(os.path.join(output_dir, filename), 'w', encoding='utf-8') as f_out:
                     f_out.write(content.strip())
+                yield filename
 
 
 class ArchiveConverter(Converter):
-    def convert(self, input_path, output_dir):
-        """Base class for archive converters."""
+    def _open(self, input_path):
+        """Open the archive; the result must offer infolist(), read() and open()."""
         raise NotImplementedError("Use specific archive converter (Zip/Rar)")
 
+    def select_members(self, infos):
+        """
+        The convertible members grouped per book, each group best format
+        first, and the groups in archive name order.
+        """
+        books = {}
+        for info in infos:
+            if info.is_dir():
+                continue
+            stem, ext = os.path.splitext(os.path.basename(info.filename))
+            ext = ext.lower()
+            # Skips .nfo, images and the like, and macOS "._" resource forks
+            if ext not in ARCHIVE_MEMBER_PRIORITY or stem.startswith('.'):
+                continue
+            books.setdefault(slugify(stem), []).append((ARCHIVE_MEMBER_PRIORITY[ext], info))
+        groups = [[info for _, info in sorted(group, key=lambda c: (c[0], c[1].filename))]
+                  for group in books.values()]
+        return sorted(groups, key=lambda group: group[0].filename)
+
+    def iter_sections(self, input_path, output_dir):
+        """
+        Convert the selected members in parallel straight from the archive.
+        Their sections land in output_dir prefixed with the member's
+        number, so one index keeps members (and their sections) in order.
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        with self._open(input_path) as archive:
+            members = self.select_members(archive.infolist())
+            if not members:
+                raise ValueError(f"No convertible books in {input_path}")
+
+            # Zero-padded wide enough that index.json's sort keeps member order
+            width = max(2, len(str(len(members) - 1)))
+            lock = threading.Lock()
+            finished = queue.Queue()
+            produced = 0
+            with ThreadPoolExecutor(max_workers=min(ARCHIVE_WORKERS, len(members))) as pool:
+                for n, candidates in enumerate(members):
+                    pool.submit(self._convert_book, archive, lock, candidates, f"{n:0{width}d}_",
+                                output_dir, finished)
+                remaining = len(members)
+                while remaining:
+                    filename = finished.get()
+                    if filename is None:
+                        remaining -= 1
+                    else:
+                        produced += 1
+                        yield filename
+        if not produced:
+            raise ValueError(f"No member of {input_path} could be converted")
+
+    def _convert_book(self, archive, lock, candidates, prefix, output_dir, finished):
+        """Convert one book from its best member, falling back to other formats."""
+        try:
+            for info in candidates:
+                if self._convert_member(archive, lock, info, prefix, output_dir, finished):
+                    return
+        finally:
+            finished.put(None)
+
+    def _convert_member(self, archive, lock, info, prefix, output_dir, finished):
+        """Returns whether the member produced any sections."""
+        member_dir = os.path.join(output_dir, f".member_{prefix}")
+        temp_path = None
+        produced = False
+        try:
+            converter = get_converter(info.filename)
+            # Decompression shares the archive handle, so it is serialized
+            with lock:
+                if converter.reads_streams:
+                    source = BytesIO(archive.read(info))
+                else:
+                    # Path-only libraries get just this member written out
+                    ext = os.path.splitext(info.filename)[1]
+                    with tempfile.NamedTemporaryFile(suffix=ext, delete=False) as temp, \
+                            archive.open(info) as member:
+                        shutil.copyfileobj(member, temp, 1024 * 1024)
+                    source = temp_path = temp.name
+
+            for filename in converter.iter_sections(source, member_dir):
+                os.replace(os.path.join(member_dir, filename), os.path.join(output_dir, prefix + filename))
+                finished.put(prefix + filename)
+                produced = True
+        except Exception as e:
+            print(f"[!] Skipping archive member {info.filename}: {e}")
+        finally:
+            if temp_path:
+                os.remove(temp_path)
+            shutil.rmtree(member_dir, ignore_errors=True)
+        return produced
+
 
 class ZipConverter(ArchiveConverter):
-    def convert(self, input_path, output_dir):
-        """Extract and convert contents of ZIP archives."""
-        with tempfile.TemporaryDirectory() as temp_dir:
-            with zipfile.ZipFile(input_path, 'r') as zip_ref:
-                zip_ref.extractall(temp_dir)
-            self._process_extracted(temp_dir, output_dir)
-
-    def _process_extracted(self, temp_dir, output_dir):
-        """Process all files in extracted directory."""
-        for root, _, files in os.walk(temp_dir):
-            for file in files:
-                file_path = os.path.join(root, file)
-                if os.path.isfile(file_path):
-                    base_name = os.path.splitext(file)[0]
-                    sub_output = os.path.join(output_dir, base_name)
-                    convert_ebook(file_path, sub_output)
+    def _open(self, input_path):
+        return zipfile.ZipFile(input_path, 'r')
 
 
 class RarConverter(ArchiveConverter):
-    def convert(self, input_path, output_dir):
-        """Extract and convert contents of RAR archives."""
-        with tempfile.TemporaryDirectory() as temp_dir:
-            with rarfile.RarFile(input_path) as rf:
-                rf.extractall(temp_dir)
-            self._process_extracted(temp_dir, output_dir)
-
-    def _process_extracted(self, temp_dir, output_dir):
-        """Process all files in extracted directory (same as ZIP)."""
-        for root, _, files in os.walk(temp_dir):
-            for file in files:
-                file_path: str = os.path.join(root, file)
-                if os.path.isfile(file_path):
-                    base_name: str = os.path.splitext(file)[0]
-                    sub_output: str = os.path.join(output_dir, base_name)
-                    convert_ebook(file_path, sub_output)
+    def _open(self, input_path):
+        return rarfile.RarFile(input_path)
 
 
 # [Keep all existing converters (EpubConverter, MobiConverter, etc.) here]
@@ -252,20 +502,23 @@ def get_converter(input_path):
         return converters[ext]()
     raise ValueError(f"Unsupported file format: {ext}")
 
-def create_index(dir_path):
-    """Create an index.txt file in the output directory."""
-    files = sorted([f for f in os.listdir(dir_path) if f.endswith('.txt')])
-    with open(os.path.join(dir_path, 'index.json'), 'w') as f:
-        json.dump(files, f)
+def create_index(dir_path, sections=(), complete=True):
+    """Write index.json listing the given sections plus any .txt already in the directory."""
+    files = {f for f in os.listdir(dir_path) if f.endswith('.txt')}
+    write_index(dir_path, list(files | set(sections)), complete)
 
 
-def convert_ebook(input_path, output_dir):
+def convert_ebook(input_path, output_dir, on_section=None):
     """
     Convert an ebook file or archive to individual text files in the output directory.
+    index.json is rewritten after every section with complete=False, and
+    once more with complete=True at the end.
 
     Args:
         input_path (str): Path to the input file/archive
         output_dir (str): Directory where text files will be saved
+        on_section (callable): Optional, called with (filename, sections so far)
+            after each section is written and indexed
     """
     # Check if input exists
     if not os.path.exists(input_path):
@@ -275,8 +528,13 @@ def convert_ebook(input_path, output_dir):
     os.makedirs(output_dir, exist_ok=True)
 
     converter = get_converter(input_path)
-    converter.convert(input_path, output_dir)
-    create_index(output_dir)
+    sections = []
+    for filename in converter.iter_sections(input_path, output_dir):
+        sections.append(filename)
+        write_index(output_dir, sections, complete=False)
+        if on_section:
+            on_section(filename, len(sections))
+    create_index(output_dir, sections)
     print(f"Conversion complete. Files saved to {output_dir}")
 
 # Example usage:
@@ -1,48 +1,212 @@
 from jaraco.stream import buffer
-from irc.client import SimpleIRCClient, ServerConnection, NickMask
+from irc.client import SimpleIRCClient, NickMask
 import irc.client
+import os
+import queue
+import random
 import re
 import socket
-import os
+import struct
+import threading
+import time
 import zipfile
 
-SERVER = "irc.irchighway.net"
-PORT = 6667
-CHANNEL = "#ebooks"
-NICK = "EbookSeeker123"
+from app.job_store import update_job
 
-class IRCXDCCClient(SimpleIRCClient):
-    def __init__(self, query: str, job_id: str, save_dir: str, is_list_request: bool):
-        super().__init__()
-        self.reactor.add_global_handler("ctcp", self.on_ctcp)
+# Overridable so the manager can be pointed at a local fake IRC/DCC server
+SERVER = os.getenv("IRC_SERVER", "irc.irchighway.net")
+PORT = int(os.getenv("IRC_PORT", 6667))
+CHANNEL = os.getenv("IRC_CHANNEL", "#ebooks")
+NICK = os.getenv("IRC_NICK", "EbookSeeker123")
+SAVE_DIR = os.getenv("IRC_SAVE_DIR", "/data/books")
+
+# How long a job waits for its search results or book to arrive
+REQUEST_TIMEOUT = float(os.getenv("IRC_REQUEST_TIMEOUT", 900))
+# Spacing between channel messages so the server doesn't flood-kick us
+SEND_INTERVAL = float(os.getenv("IRC_SEND_INTERVAL", 2))
+RECONNECT_DELAY = float(os.getenv("IRC_RECONNECT_DELAY", 10))
+
+# DCC receive tuning: one large preallocated buffer per transfer
+DCC_BUFFER_SIZE = int(os.getenv("DCC_BUFFER_SIZE", 256 * 1024))
+# Seconds without a single byte before a transfer counts as stalled
+DCC_STALL_TIMEOUT = float(os.getenv("DCC_STALL_TIMEOUT", 60))
+# Interrupted book transfers are re-requested and resumed this many times
+DCC_MAX_RETRIES = int(os.getenv("DCC_MAX_RETRIES", 3))
+# Minimum seconds between progress writes to the job store
+DCC_PROGRESS_INTERVAL = float(os.getenv("DCC_PROGRESS_INTERVAL", 1))
+# Seconds a book candidate gets to produce an offer before the next one is tried alongside it
+DOWNLOAD_STAGGER = float(os.getenv("DOWNLOAD_STAGGER", 45))
+
+
+def _normalize(name: str) -> str:
+    return re.sub(r'\s+', ' ', name.replace('_', ' ')).strip().lower()
+
+
+def _tokens(text: str) -> set:
+    return set(re.findall(r'[a-z0-9]+', text.lower()))
+
+
+class PendingRequest:
+    """One job's @search or !bot request, resolved when its file has arrived."""
+
+    def __init__(self, kind: str, query: str, job_id: str):
+        self.kind = kind  # "search" or "book"
         self.query = query
         self.job_id = job_id
-        self.save_dir = save_dir
-        self.saved_file: str = ''
-        self.is_list_request = is_list_request
-        self.search_accepted = False
-        self.done = False
+        self.bot = None
+        self.filename = None
+        if kind == "book":
+            # "!BotName Some File.epub ::INFO:: 1.2MB"
+            match = re.match(r'^!(\S+)\s+(.*?)(?:\s*::INFO::.*)?$', query)
+            if match:
+                self.bot, self.filename = match.group(1), match.group(2)
+        else:
+            self.terms = _tokens(query.replace('@search', '', 1))
+        # Part files are per bot, so candidates racing for the same job never
+        # resume from, truncate or delete each other's data
+        self.owner = re.sub(r'[^\w-]', '_', self.bot or kind)
+        self.sent = False
+        self.offered = False
+        self.attempts = 0
+        self.saved_file = ''
+        self.error = None
+        self.done = threading.Event()
+
+    def resolve(self, saved_file: str = '', error: str | None = None):
+        self.saved_file = saved_file
+        self.error = error
+        self.done.set()
+
+    def wait(self, timeout: float) -> str:
+        if not self.done.wait(timeout):
+            raise TimeoutError(f"No DCC transfer for '{self.query}' within {timeout:.0f}s")
+        if self.error:
+            raise RuntimeError(self.error)
+        return self.saved_file
+
+
+class IRCSessionManager(SimpleIRCClient):
+    """
+    One long-lived, registered IRC connection shared by every download job
+    in this process. Requests from many jobs are queued onto the channel,
+    incoming DCC SEND offers are matched back to the job that asked for
+    them, and each transfer runs on its own thread.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.pending: list[PendingRequest] = []
+        self.outbox: queue.Queue[PendingRequest] = queue.Queue()
+        self.joined = threading.Event()
+        # port -> (request, filename, ip, size) for offers awaiting DCC ACCEPT
+        self.resumes: dict[int, tuple] = {}
+
+    def start_session(self):
+        irc.client.ServerConnection.buffer_class = buffer.LenientDecodingLineBuffer
+        threading.Thread(target=self._run, name="irc-session", daemon=True).start()
+        threading.Thread(target=self._send_loop, name="irc-send", daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                self.connect(SERVER, PORT, NICK)
+                break
+            except irc.client.ServerConnectionError as e:
+                print(f"[!] IRC connect failed: {e}; retrying in {RECONNECT_DELAY}s")
+                time.sleep(RECONNECT_DELAY)
+        self.reactor.process_forever()
+
+    def _reconnect(self):
+        try:
+            self.connection.reconnect()
+        except irc.client.ServerConnectionError as e:
+            print(f"[!] IRC reconnect failed: {e}")
+            self.reactor.scheduler.execute_after(RECONNECT_DELAY, self._reconnect)
+
+    def submit(self, request: PendingRequest) -> PendingRequest:
+        with self.lock:
+            self.pending.append(request)
+        self.outbox.put(request)
+        return request
 
-    def on_raw(self, connection, event):
-        print(f"[RAW] {event.arguments}")
+    def discard(self, request: PendingRequest):
+        with self.lock:
+            if request in self.pending:
+                self.pending.remove(request)
+
+    def _finish(self, request: PendingRequest, saved_file: str = '', error: str | None = None):
+        self.discard(request)
+        request.resolve(saved_file, error)
+
+    def _send_loop(self):
+        # The only sender thread: nothing a single request does may end it
+        while True:
+            request = self.outbox.get()
+            if request.done.is_set():
+                continue
+            self.joined.wait()
+            with self.reactor.mutex:
+                sent = self._send(request)
+            if sent:
+                request.sent = True
+                time.sleep(SEND_INTERVAL)
+
+    def _send(self, request: PendingRequest) -> bool:
+        """Send a request to the channel; called with the reactor mutex held."""
+        if not self.joined.is_set():
+            # Dropped while waiting for the mutex; send after the rejoin
+            self.outbox.put(request)
+            return False
+        print(f"[*] Sending for job {request.job_id}: {request.query}")
+        try:
+            self.connection.privmsg(CHANNEL, request.query)
+        except irc.client.ServerNotConnectedError:
+            # on_disconnect reconnects; hold the queue until the rejoin
+            self.joined.clear()
+            self.outbox.put(request)
+            return False
+        except ValueError as e:
+            # InvalidCharacters or MessageTooLong: this request can never be sent
+            self._finish(request, error=f"Can't send '{request.query}': {e}")
+            return False
+        return True
 
     def on_welcome(self, connection, event):
         print("[*] Connected to server.")
         connection.join(CHANNEL)
 
+    def on_nicknameinuse(self, connection, event):
+        connection.nick(f"{NICK}{random.randint(100, 999)}")
+
     def on_join(self, connection, event):
-        if NICK in event.source:
-            print(f"[*] Joined {CHANNEL}. Sending @search to channel...")
-            connection.privmsg(CHANNEL, self.query)
+        if NickMask(event.source).nick == connection.get_nickname():
+            print(f"[*] Joined {CHANNEL}.")
+            # Anything sent before a reconnect without an offer yet is re-sent
+            with self.lock:
+                resend = [r for r in self.pending if r.sent and not r.offered]
+            for request in resend:
+                request.sent = False
+                self.outbox.put(request)
+            self.joined.set()
+
+    def on_disconnect(self, connection, event):
+        print("[!] Disconnected from IRC, reconnecting...")
+        self.joined.clear()
+        self.reactor.scheduler.execute_after(RECONNECT_DELAY, self._reconnect)
 
     def on_pubmsg(self, connection, event):
         sender = NickMask(event.source).nick
         message = event.arguments[0]
         print(f"[PUBMSG] <{sender}> {message}")
 
-        if "Your search for" in message and not self.search_accepted:
-            print("[*] Search accepted, waiting for DCC SEND...")
-            self.search_accepted = True
+    def on_privnotice(self, connection, event):
+        message = event.arguments[0]
+        print(f"[NOTICE] <{NickMask(event.source).nick}> {message}")
+        if "returned no matches" in message or "no results" in message.lower():
+            request = self._match_search(message)
+            if request:
+                self._finish(request, error=f"No search results for '{request.query}'")
 
     def on_ctcp(self, connection, event):
         sender = NickMask(event.source).nick
@@ -51,8 +215,9 @@ class IRCXDCCClient(SimpleIRCClient):
         print(f"[CTCP] <{sender}> {ctcp_type}: {content}")
 
         if ctcp_type == "DCC" and content.startswith("SEND"):
-            print("[*] DCC SEND detected via CTCP.")
-            self.handle_dcc_send(f"{ctcp_type} {content}")
+            self.handle_dcc_send(sender, f"{ctcp_type} {content}")
+        elif ctcp_type == "DCC" and content.startswith("ACCEPT"):
+            self.handle_dcc_accept(content)
 
     def on_privmsg(self, connection, event):
         sender = NickMask(event.source).nick
@@ -60,15 +225,37 @@ class IRCXDCCClient(SimpleIRCClient):
         print(f"[PRIVMSG] <{sender}> {message}")
 
         if message.startswith("\x01DCC SEND"):
-            print("[*] DCC SEND detected.")
-            self.handle_dcc_send(message)
+            self.handle_dcc_send(sender, message)
+        elif message.startswith("\x01DCC ACCEPT"):
+            self.handle_dcc_accept(message)
 
-    def on_dccmsg(self, connection, event):
-            print("[DCCMSG] Received DCC message.")
-            dcc_msg = event.arguments[0]
-            self.handle_dcc_send(dcc_msg)
+    def _match_search(self, text: str) -> PendingRequest | None:
+        # The results zip is named after the search terms; the oldest
+        # request with the best term overlap wins, and none without any
+        name_tokens = _tokens(text)
+        with self.lock:
+            searches = [r for r in self.pending if r.kind == "search" and r.sent and not r.offered]
+        best, best_overlap = None, 0
+        for request in searches:
+            overlap = len(request.terms & name_tokens)
+            if overlap > best_overlap:
+                best, best_overlap = request, overlap
+        return best
 
-    def handle_dcc_send(self, dcc_msg):
+    def _match_offer(self, sender: str, filename: str) -> PendingRequest | None:
+        name = _normalize(filename)
+        with self.lock:
+            books = [r for r in self.pending
+                     if r.kind == "book" and not r.offered and r.bot and r.bot.lower() == sender.lower()]
+        exact = [r for r in books if r.filename and _normalize(r.filename) == name]
+        request = (exact or books or [None])[0]
+        if request is None and filename.lower().endswith(".zip"):
+            request = self._match_search(filename)
+        if request:
+            request.offered = True
+        return request
+
+    def handle_dcc_send(self, sender: str, dcc_msg: str):
         print(f"[*] DCC message: {dcc_msg}")
         # Modified regex to handle unquoted filenames
         match = re.search(r'DCC SEND "?([^"]+?)"? (\d+) (\d+) (\d+)', dcc_msg)
@@ -77,73 +264,243 @@ class IRCXDCCClient(SimpleIRCClient):
             return
 
         filename, ip_int, port, size = match.groups()
+        request = self._match_offer(sender, filename)
+        if request is None:
+            print(f"[!] No pending request for DCC offer of {filename} from {sender}")
+            return
+
         ip = socket.inet_ntoa(int(ip_int).to_bytes(4, 'big'))
-        port = int(port)
-        size = int(size)
-
-        print(f"[*] Receiving file: {filename} ({size} bytes) from {ip}:{port}")
-        filepath = os.path.join(self.save_dir, self.job_id, filename)
-        self.saved_file = filepath
-        self.receive_file(ip, port, filepath, size)
-
-        if self.is_list_request and filename.endswith(".zip"):
-            self.extract_zip(filepath)
-
-        self.done = True
-        raise SystemExit(0)
-
-    def receive_file(self, ip, port, filename, size):
-        os.makedirs(os.path.dirname(filename), exist_ok=True)
-        with socket.socket() as s:
-            s.connect((ip, port))
-            with open(filename, "wb") as f:
-                received = 0
-                while received < size:
-                    data = s.recv(4096)
-                    if not data:
-                        break
-                    f.write(data)
-                    received += len(data)
-        print(f"[✓] Download complete: {filename}")
-
-    def extract_zip(self, zip_path):
-        os.makedirs(self.save_dir, exist_ok=True)
-        self.saved_file = os.path.join(self.save_dir, self.job_id, 'list.txt')
-        with zipfile.ZipFile(zip_path, 'r') as zf:
-            original_name = zf.namelist()[0]
-            with zf.open(original_name) as source, \
-                    open(self.saved_file, 'wb') as target:
-                target.write(source.read())
-
-    def display_search_results(self, folder):
-        for file in os.listdir(folder):
-            if file.endswith(".txt"):
-                print("\n[Search Results]")
-                with open(os.path.join(folder, file), "r", encoding="utf-8", errors="ignore") as f:
-                    lines = f.readlines()
-                    for line in lines:
-                        if line.strip().startswith("!"):
-                            print(line.strip())
+        port, size = int(port), int(size)
+        basename = os.path.basename(filename)
+
+        # A partial file left by this request's interrupted attempt is resumed, not restarted
+        offset = _partial_size(_part_path(os.path.join(SAVE_DIR, request.job_id, basename), request.owner))
+        if 0 < offset < size and port:
+            with self.lock:
+                self.resumes[port] = (request, basename, ip, size)
+            quoted = f'"{filename}"' if ' ' in filename else filename
+            print(f"[*] Resuming {basename} at byte {offset}")
+            self.connection.ctcp("DCC", sender, f"RESUME {quoted} {port} {offset}")
+            return
+        self._start_transfer(request, basename, ip, port, size, 0)
+
+    def handle_dcc_accept(self, dcc_msg: str):
+        match = re.search(r'ACCEPT "?(.+?)"? (\d+) (\d+)', dcc_msg)
+        if not match:
+            print("[!] Failed to parse DCC ACCEPT message.")
+            return
+        port, offset = int(match.group(2)), int(match.group(3))
+        with self.lock:
+            offer = self.resumes.pop(port, None)
+        if offer is None:
+            print(f"[!] DCC ACCEPT for unknown port {port}")
+            return
+        request, basename, ip, size = offer
+        self._start_transfer(request, basename, ip, port, size, offset)
+
+    def _start_transfer(self, request: PendingRequest, filename: str, ip: str, port: int,
+                        size: int, offset: int):
+        threading.Thread(
+            target=self._transfer,
+            args=(request, filename, ip, port, size, offset),
+            name=f"dcc-{request.job_id}",
+            daemon=True,
+        ).start()
+
+    def _transfer(self, request: PendingRequest, filename: str, ip: str, port: int,
+                  size: int, offset: int):
+        print(f"[*] Receiving file for job {request.job_id}: {filename} ({size} bytes) from {ip}:{port}")
+        filepath = os.path.join(SAVE_DIR, request.job_id, filename)
+        part_path = _part_path(filepath, request.owner)
+        try:
+            receive_file(ip, port, filepath, size, offset, _progress_reporter(request.job_id),
+                         stop=request.done, part_path=part_path)
+            if request.kind == "search" and filename.endswith(".zip"):
+                filepath = extract_zip(filepath, os.path.join(SAVE_DIR, request.job_id, 'list.txt'))
+        except (OSError, TimeoutError) as e:
+            if request.done.is_set():
+                # Abandoned by its job (another candidate won, or it timed out)
+                print(f"[*] Dropped transfer of {filename}: {request.error}")
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+                return
+            request.attempts += 1
+            if request.kind == "book" and request.attempts <= DCC_MAX_RETRIES and not request.done.is_set():
+                # Ask the bot again; its new offer resumes from the partial file
+                print(f"[!] Transfer of {filename} interrupted ({e}); retry {request.attempts}/{DCC_MAX_RETRIES}")
+                request.sent = request.offered = False
+                self.outbox.put(request)
+                return
+            self._finish(request, error=f"DCC transfer of {filename} failed: {e}")
+            return
+        except Exception as e:
+            self._finish(request, error=f"DCC transfer of {filename} failed: {e}")
+            return
+        self._finish(request, filepath)
+
+
+def _part_path(filename: str, owner: str = '') -> str:
+    return f"{filename}.{owner}.part" if owner else f"{filename}.part"
+
+
+def _partial_size(part_path: str) -> int:
+    try:
+        return os.path.getsize(part_path)
+    except OSError:
+        return 0
+
+
+def _progress_reporter(job_id: str):
+    def report(received: int, size: int, rate: float):
+        try:
+            update_job(job_id, {
+                "download_bytes": received,
+                "download_total": size,
+                "download_rate": round(rate),
+            })
+        except Exception as e:
+            # Progress is informational; never abort a transfer over it
+            print(f"[!] Progress update for job {job_id} failed: {e}")
+    return report
+
+
+def receive_file(ip, port, filename, size, offset=0, on_progress=None, stop=None, part_path=None):
+    """
+    Receive a DCC SEND into filename, starting at byte offset of a resumed
+    transfer. Data lands in part_path (filename.part by default), which is
+    only renamed once all size bytes arrived; an early close or stall raises
+    and leaves the part file for the next attempt to resume. Setting the
+    stop event aborts the transfer with ConnectionAbortedError.
+    """
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    part_path = part_path or _part_path(filename)
+    buf = bytearray(DCC_BUFFER_SIZE)
+    view = memoryview(buf)
+    received = offset
+    started = last_report = time.monotonic()
+
+    with socket.create_connection((ip, port), timeout=DCC_STALL_TIMEOUT) as s:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, DCC_BUFFER_SIZE)
+        with open(part_path, "r+b" if offset else "wb") as f:
+            f.seek(offset)
+            f.truncate()
+            while received < size:
+                if stop is not None and stop.is_set():
+                    raise ConnectionAbortedError(f"DCC transfer aborted at {received}/{size} bytes")
+                try:
+                    n = s.recv_into(buf)
+                except socket.timeout:
+                    raise TimeoutError(
+                        f"DCC transfer stalled at {received}/{size} bytes "
+                        f"for {DCC_STALL_TIMEOUT:.0f}s")
+                if not n:
+                    raise ConnectionError(f"DCC peer closed at {received}/{size} bytes")
+                f.write(view[:n])
+                received += n
+                # Position ack: total bytes so far as a 32-bit network-order int
+                try:
+                    s.sendall(struct.pack("!I", received & 0xFFFFFFFF))
+                except OSError:
+                    # Senders may hang up as soon as the last byte is out
+                    if received < size:
+                        raise
+
+                now = time.monotonic()
+                if on_progress and now - last_report >= DCC_PROGRESS_INTERVAL:
+                    on_progress(received, size, (received - offset) / (now - started))
+                    last_report = now
+
+    elapsed = max(time.monotonic() - started, 1e-6)
+    if on_progress:
+        on_progress(received, size, (received - offset) / elapsed)
+    os.replace(part_path, filename)
+    print(f"[✓] Download complete: {filename} ({(received - offset) / elapsed / 1e6:.1f} MB/s)")
+
+
+def extract_zip(zip_path, target_path):
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    with zipfile.ZipFile(zip_path, 'r') as zf:
+        original_name = zf.namelist()[0]
+        with zf.open(original_name) as source, \
+                open(target_path, 'wb') as target:
+            target.write(source.read())
+    return target_path
+
+
+_manager = None
+_manager_pid = None
+_manager_lock = threading.Lock()
+
+
+def get_manager() -> IRCSessionManager:
+    """This process's shared IRC session, connected on first use."""
+    global _manager, _manager_pid
+    with _manager_lock:
+        if _manager is None or _manager_pid != os.getpid():
+            _manager = IRCSessionManager()
+            _manager.start_session()
+            _manager_pid = os.getpid()
+        return _manager
+
+
+def _abandon(manager: IRCSessionManager, request: PendingRequest, reason: str):
+    manager.discard(request)
+    if not request.done.is_set():
+        # Also stops a transfer already in flight for it
+        request.resolve(error=reason)
+
+
+def _request(kind: str, query: str, job_id: str) -> str:
+    manager = get_manager()
+    request = manager.submit(PendingRequest(kind, query, job_id))
+    try:
+        return request.wait(REQUEST_TIMEOUT)
+    finally:
+        _abandon(manager, request, "abandoned")
 
 def download_list(title: str, author: str, job_id) -> str:
-    irc.client.ServerConnection.buffer_class = buffer.LenientDecodingLineBuffer
     query: str = f'@search {title} {author}'
-    client = IRCXDCCClient(query, job_id, '/data/books', True)
-    client.connect(SERVER, PORT, NICK)
-    try:
-        client.start()
-        return client.saved_file
-    except SystemExit:
-        client.connection.disconnect()
-        return client.saved_file
+    return _request("search", query, job_id)
 
 def download_book(query: str, job_id: str) -> str:
-    irc.client.ServerConnection.buffer_class = buffer.LenientDecodingLineBuffer
-    client = IRCXDCCClient(query, job_id, '/data/books', False)
-    client.connect(SERVER, PORT, NICK)
+    return _request("book", query, job_id)
+
+def download_first(queries: list[str], job_id: str, on_failure=None) -> tuple[str, str]:
+    """
+    Race book requests for several candidates, best first, and return
+    (path, query) of the first that arrives. The next candidate joins the
+    race whenever the running ones have all failed, or none has produced an
+    offer within DOWNLOAD_STAGGER seconds. Losers are abandoned once one
+    wins. on_failure(query, error) is called for every candidate that fails.
+    Candidates should name distinct files: they all land in the job's
+    directory under the offered filename.
+    """
+    manager = get_manager()
+    remaining = list(queries)
+    running: list[PendingRequest] = []
+    deadline = time.monotonic() + REQUEST_TIMEOUT
+    last_launch = float('-inf')
+    errors = []
     try:
-        client.start()
-        return client.saved_file
-    except SystemExit:
-        print("[*] Finished and exiting.")
-        return client.saved_file
\ No newline at end of file
+        while True:
+            stalled = not any(r.offered for r in running) and time.monotonic() - last_launch >= DOWNLOAD_STAGGER
+            if remaining and (not running or stalled):
+                running.append(manager.submit(PendingRequest("book", remaining.pop(0), job_id)))
+                last_launch = time.monotonic()
+
+            for request in [r for r in running if r.done.is_set()]:
+                running.remove(request)
+                if not request.error:
+                    return request.saved_file, request.query
+                errors.append(request.error)
+                if on_failure:
+                    on_failure(request.query, request.error)
+
+            if not running and not remaining:
+                raise RuntimeError(f"All {len(queries)} candidates failed: {'; '.join(errors)}")
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"No candidate arrived within {REQUEST_TIMEOUT:.0f}s")
+            time.sleep(0.5)
+    finally:
+        for request in running:
+            _abandon(manager, request, "abandoned")
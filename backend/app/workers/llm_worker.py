@@ -1,23 +1,19 @@
 # backend/app/workers/llm_worker.py
 import os
+import re
 import json
-from openai import OpenAI
+import time
+from app.workers.openai_client import get_client
+from app import guess_cache
 
-client = OpenAI(
-    api_key=os.getenv("OPENAI_API_KEY")
-)
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o")
+# Stream completions and report fields as they form; set 0 to wait for the full reply
+LLM_STREAM = os.getenv("LLM_STREAM", "1") == "1"
+# Minimum seconds between partial updates while a string is still growing
+PARTIAL_INTERVAL = float(os.getenv("LLM_PARTIAL_INTERVAL", 0.15))
 
-def query_llm_for_book(history: list) -> dict:
-    """
-    Query OpenAI GPT with a conversation history to guess the book or ask clarifying questions.
-
-    :param history: List of dicts with 'role' and 'content'.
-    :return: Structured dict with either 'confident' guess or 'need_clarification'.
-    """
-    print("HISTORY")
-    print(history)
-    # System prompt preserved from your original style
-    system_prompt = """
+# System prompt preserved from your original style
+SYSTEM_PROMPT = """
 You are an assistant helping to identify books based on user descriptions and clarifications.
 
 Your task:
@@ -41,23 +37,222 @@ Important rules:
 - Ask **only one** clarifying question at a time if unsure.
 - Your question should never be is the book you're thinking of X by A? Only ask for clues until you are confident.
 - If confident, do NOT ask a question, just output the structured guess.
-    """.strip()
-
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            *history,
-        ],
-        temperature=0  # deterministic
+""".strip()
+
+# Once the prompt history, summary included, passes this many (estimated)
+# tokens, older turns are folded into the summary and only the last few are
+# sent verbatim.
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 1500))
+# At least the latest message always goes out verbatim
+HISTORY_KEEP_MESSAGES = max(1, int(os.getenv("HISTORY_KEEP_MESSAGES", 4)))
+# The summary itself never grows past this; the oldest entries go first
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", 600))
+CLUE_MAX_CHARS = int(os.getenv("SUMMARY_CLUE_MAX_CHARS", 400))
+QUESTION_MAX_CHARS = 160
+ANSWER_MAX_CHARS = 60
+
+_yes_regex = re.compile(r"^\s*(yes|yeah|yep|yup|correct|right|sure)\b", re.IGNORECASE)
+_no_regex = re.compile(r"^\s*(no|nope|nah|not really|incorrect|wrong)\b", re.IGNORECASE)
+
+
+def estimate_tokens(messages: list) -> int:
+    # ~4 characters per token is close enough to decide when to compact
+    return sum(len(m.get("content") or "") for m in messages) // 4 + 4 * len(messages)
+
+
+def _clip(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    if len(text) <= limit:
+        return text
+    return text[:limit].rsplit(" ", 1)[0] + "..."
+
+
+def _short_answer(reply: str) -> str:
+    # Most replies are to yes/no questions; keep just the fact
+    if _yes_regex.match(reply):
+        return "yes"
+    if _no_regex.match(reply):
+        return "no"
+    return _clip(reply, ANSWER_MAX_CHARS)
+
+
+def _fold_into_summary(summary: dict, messages: list) -> dict:
+    """
+    Fold messages into a structured summary: user descriptions become
+    clipped clues, an assistant question followed by the user's reply
+    becomes a short answer. Past SUMMARY_TOKEN_BUDGET the oldest answers
+    are dropped, then every clue but the first description.
+    """
+    clues = list(summary.get("clues", []))
+    answers = list(summary.get("answers", []))
+    pending_question = None
+    for message in messages:
+        content = (message.get("content") or "").strip()
+        if message.get("role") == "assistant":
+            pending_question = content
+        elif pending_question is not None:
+            answers.append({"question": _clip(pending_question, QUESTION_MAX_CHARS),
+                            "answer": _short_answer(content)})
+            pending_question = None
+        elif content:
+            clues.append(_clip(content, CLUE_MAX_CHARS))
+
+    folded = {
+        "clues": clues,
+        "answers": answers,
+        "covered": summary.get("covered", 0) + len(messages),
+    }
+    while estimate_tokens([summary_message(folded)]) > SUMMARY_TOKEN_BUDGET:
+        if answers:
+            answers.pop(0)
+        elif len(clues) > 1:
+            clues.pop(1)
+        else:
+            break
+    return folded
+
+
+def summary_message(summary: dict) -> dict:
+    lines = ["Summary of the conversation so far."]
+    if summary.get("clues"):
+        lines.append("Clues the user gave:")
+        lines.extend(f"- {clue}" for clue in summary["clues"])
+    if summary.get("answers"):
+        lines.append("Your earlier questions and the user's answers:")
+        lines.extend(f"- {a['question']} -> {a['answer']}" for a in summary["answers"])
+    return {"role": "user", "content": "\n".join(lines)}
+
+
+def compact_history(summary: dict | None, recent: list) -> tuple[dict | None, list]:
+    """
+    Build the messages to send from the stored summary and the history after
+    it. Returns (summary, messages); the summary is only rebuilt, and so only
+    changes, when the two together pass HISTORY_TOKEN_BUDGET.
+    """
+    sent = [summary_message(summary), *recent] if summary else recent
+    if estimate_tokens(sent) > HISTORY_TOKEN_BUDGET and len(recent) > HISTORY_KEEP_MESSAGES:
+        cut = len(recent) - HISTORY_KEEP_MESSAGES
+        # Keep a question together with its answer: start the tail on an assistant turn
+        while cut > 0 and recent[cut].get("role") != "assistant":
+            cut -= 1
+        if cut > 0:
+            summary = _fold_into_summary(summary or {}, recent[:cut])
+            recent = recent[cut:]
+
+    if not summary:
+        return summary, recent
+    return summary, [summary_message(summary), *recent]
+
+
+PARTIAL_FIELDS = ("status", "question", "title", "author")
+# A JSON string member, possibly still open: "key": "value-so-far
+_field_regex = re.compile(r'"(%s)"\s*:\s*"((?:[^"\\]|\\.)*)(")?' % "|".join(PARTIAL_FIELDS))
+
+
+def _decode_json_string(raw: str) -> str | None:
+    try:
+        return json.loads(f'"{raw}"')
+    except json.JSONDecodeError:
+        return None
+
+
+def parse_partial_guess(buffer: str) -> dict:
+    """
+    Pull the known string fields out of a possibly incomplete JSON reply.
+    Returns {field: (value_so_far, complete)}.
+    """
+    fields = {}
+    for match in _field_regex.finditer(buffer):
+        key, raw, closing = match.groups()
+        value = _decode_json_string(raw)
+        if value is not None:
+            fields[key] = (value, closing is not None)
+    return fields
+
+
+def _stream_completion(messages: list, on_partial) -> str:
+    stream = get_client().chat.completions.create(
+        model=LLM_MODEL,
+        messages=messages,
+        temperature=0,  # deterministic
+        stream=True,
     )
 
-    content = response.choices[0].message.content
+    content = ""
+    reported = {}
+    last_report = 0.0
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        content += chunk.choices[0].delta.content or ""
+        if on_partial is None:
+            continue
+
+        fields = parse_partial_guess(content)
+        completed = any(done and not reported.get(k, ("", False))[1] for k, (_, done) in fields.items())
+        changed = fields != reported
+        # Report right away when a field closes; throttle a string that is still growing
+        if changed and (completed or time.monotonic() - last_report >= PARTIAL_INTERVAL):
+            reported = fields
+            last_report = time.monotonic()
+            on_partial(_visible_partial(fields))
+    return content
+
+
+def _visible_partial(fields: dict) -> dict:
+    # A question is useful while it forms; a title/author only once complete
+    partial = {}
+    for key, (value, complete) in fields.items():
+        if complete or key == "question":
+            partial[key] = value
+    return partial
+
+
+def query_llm_for_book(history: list, on_partial=None, use_cache: bool = True) -> dict:
+    """
+    Query OpenAI GPT with a conversation history to guess the book or ask clarifying questions.
+
+    :param history: List of dicts with 'role' and 'content'.
+    :param on_partial: Optional callback receiving the fields parsed so far
+        (question as it forms, status/title/author once complete) while the
+        reply streams in.
+    :param use_cache: Set False to bypass the guess cache for this call.
+    :return: Structured dict with either 'confident' guess or 'need_clarification'.
+    """
+    print("HISTORY")
+    print(history)
+
+    use_cache = use_cache and guess_cache.GUESS_CACHE_ENABLED
+    if use_cache:
+        key = guess_cache.cache_key(SYSTEM_PROMPT, LLM_MODEL, history)
+        cached = guess_cache.get(key)
+        if cached is not None:
+            print(f"[DEBUG] Guess cache hit: {cached}")
+            return cached
+
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        *history,
+    ]
+
+    if LLM_STREAM:
+        content = _stream_completion(messages, on_partial)
+    else:
+        response = get_client().chat.completions.create(
+            model=LLM_MODEL,
+            messages=messages,
+            temperature=0  # deterministic
+        )
+        content = response.choices[0].message.content
     print(f"[DEBUG] LLM raw output: {content}")
 
     try:
         # Parse response safely
-        return json.loads(content)
+        guess = json.loads(content)
     except json.JSONDecodeError as e:
         print(f"[ERROR] Failed to parse LLM JSON response: {e}")
         return {"status": "error", "error": str(e), "raw_response": content}
+
+    if use_cache:
+        guess_cache.put(key, guess)
+    return guess
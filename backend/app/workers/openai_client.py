@@ -0,0 +1,44 @@
+# backend/app/workers/openai_client.py
+import os
+
+import httpx
+from openai import OpenAI
+
+# Point at any OpenAI-compatible server (e.g. a local stand-in for load
+# tests); unset means the real API.
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", 60))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", 5))
+# The SDK retries connection errors, 408/409/429 and 5xx with exponential backoff
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", 3))
+
+_client = None
+_client_pid = None
+
+
+def get_client() -> OpenAI:
+    """
+    Return this process's OpenAI client, creating it on first use. Celery
+    forks its pool workers, so each child builds its own client rather than
+    inheriting the parent's connection pool.
+    """
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            if not OPENAI_BASE_URL:
+                raise RuntimeError("Missing OPENAI_API_KEY environment variable!")
+            # Local stand-ins usually ignore the key, but the SDK requires one
+            api_key = "local"
+
+        _client = OpenAI(
+            api_key=api_key,
+            base_url=OPENAI_BASE_URL,
+            timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+            max_retries=OPENAI_MAX_RETRIES,
+            http_client=httpx.Client(
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60),
+            ),
+        )
+        _client_pid = os.getpid()
+    return _client
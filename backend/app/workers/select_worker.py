@@ -1,4 +1,8 @@
+import math
 import re
+from difflib import SequenceMatcher
+
+from app.job_store import redis_client
 
 # Priority order: lower is better
 ext_priority = {
@@ -11,36 +15,143 @@ ext_priority = {
 
 # Build regex to match only the allowed extensions at the end
 ext_regex = re.compile(
-    r'^!(\w+)\s+(.*?)\s*(?:::\s*INFO::.*)?\s*$', re.IGNORECASE
+    r'^!(\w+)\s+(.*?)\s*(?:::\s*INFO::\s*(.*))?\s*$', re.IGNORECASE
 )
 
 # Only accept entries that end with the correct extension
 valid_extensions = tuple(ext_priority.keys())
 
+_filename_ext_regex = re.compile(
+    r'\.(' + '|'.join(e[1:] for e in ext_priority) + r')$', re.IGNORECASE
+)
+_size_regex = re.compile(r'([\d.]+)\s*([KMG]?i?B)', re.IGNORECASE)
+_size_units = {'b': 1, 'kb': 1e3, 'kib': 1024, 'mb': 1e6, 'mib': 1024 ** 2, 'gb': 1e9, 'gib': 1024 ** 3}
+_token_regex = re.compile(r'[a-z0-9]+')
+
+# Score weights; the match against the guess dominates, the rest break ties
+TITLE_WEIGHT = 5.0
+AUTHOR_WEIGHT = 3.0
+# Penalizes names with words beyond the guess ("Dune Messiah" for "Dune")
+PRECISION_WEIGHT = 2.0
+FORMAT_WEIGHT = 1.0
+SIZE_WEIGHT = 1.0
+BOT_WEIGHT = 1.5
+
+# Typical ebook sizes; anything far outside is likely junk or a scan
+MIN_BOOK_BYTES = 20 * 1024
+IDEAL_BOOK_BYTES = 1.5e6
+
+BOT_OK_KEY = "irc:bots:ok"
+BOT_FAILED_KEY = "irc:bots:failed"
+
+
 def extract_extension(filename):
     # Match extension at the end
-    match = re.search(r'\.(' + '|'.join(e[1:] for e in ext_priority) + r')$', filename, re.IGNORECASE)
+    match = _filename_ext_regex.search(filename)
     if match:
         return '.' + match.group(1).lower()
     return None
 
-def parse_and_sort(file_path):
-    entries = []
 
-    with open(file_path, 'r', encoding='utf-8') as f:
+def parse_size(info: str | None) -> int | None:
+    """Bytes from an ::INFO:: field like '1.2MB', or None if it has none."""
+    match = _size_regex.search(info or '')
+    if not match:
+        return None
+    unit = _size_units.get(match.group(2).lower())
+    return int(float(match.group(1)) * unit) if unit else None
+
+
+def iter_entries(file_path):
+    """Stream the usable entries of a search result list, one line at a time."""
+    with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
         for line in f:
             line = line.strip()
             m = ext_regex.match(line)
-            if m:
-                filename = m.group(2)
-                ext = extract_extension(filename)
-                if ext in ext_priority:
-                    entries.append({
-                        'original_line': line,
-                        'filename': filename,
-                        'extension': ext,
-                        'priority': ext_priority[ext]
-                    })
-
-    return sorted(entries, key=lambda e: e['priority'])
+            if not m:
+                continue
+            filename = m.group(2)
+            ext = extract_extension(filename)
+            if ext in ext_priority:
+                yield {
+                    'original_line': line,
+                    'bot': m.group(1),
+                    'filename': filename,
+                    'extension': ext,
+                    'priority': ext_priority[ext],
+                    'size': parse_size(m.group(3)),
+                }
+
+
+def _tokens(text: str) -> list[str]:
+    return _token_regex.findall(text.lower())
+
+
+def _match(wanted: str, filename: str, name_tokens: set) -> float:
+    """0..1 fuzzy match of a title or author against a filename."""
+    tokens = _tokens(wanted)
+    if not tokens:
+        return 0.0
+    recall = sum(t in name_tokens for t in tokens) / len(tokens)
+    # Catches spelling and spacing variants token recall misses
+    ratio = SequenceMatcher(None, ' '.join(tokens), filename).find_longest_match().size / len(' '.join(tokens))
+    return max(recall, ratio)
+
+
+def _size_score(size: int | None) -> float:
+    if size is None:
+        return 0.5
+    if size < MIN_BOOK_BYTES:
+        return 0.0
+    # 1 at the ideal size, falling off with each order of magnitude away
+    return max(0.0, 1 - abs(math.log10(size / IDEAL_BOOK_BYTES)) / 2)
+
+
+def bot_reliability() -> dict:
+    """Laplace-smoothed success rate per bot from earlier downloads."""
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hgetall(BOT_OK_KEY)
+    pipe.hgetall(BOT_FAILED_KEY)
+    ok, failed = ({k.decode(): int(v) for k, v in raw.items()} for raw in pipe.execute())
+    return {
+        bot: (ok.get(bot, 0) + 1) / (ok.get(bot, 0) + failed.get(bot, 0) + 2)
+        for bot in ok.keys() | failed.keys()
+    }
+
+
+def record_bot_result(bot: str, ok: bool):
+    redis_client.hincrby(BOT_OK_KEY if ok else BOT_FAILED_KEY, bot.lower(), 1)
+
+
+def score_entry(entry: dict, title: str, author: str, reliability: dict) -> float:
+    filename = entry['filename'].lower()
+    name_tokens = set(_tokens(filename[:-len(entry['extension'])]))
+    wanted = set(_tokens(f"{title} {author}"))
+    precision = len(name_tokens & wanted) / len(name_tokens) if wanted and name_tokens else 0.0
+    return (
+        TITLE_WEIGHT * _match(title, filename, name_tokens)
+        + AUTHOR_WEIGHT * _match(author, filename, name_tokens)
+        + PRECISION_WEIGHT * precision
+        + FORMAT_WEIGHT * (1 - entry['priority'] / len(ext_priority))
+        + SIZE_WEIGHT * _size_score(entry['size'])
+        + BOT_WEIGHT * reliability.get(entry['bot'].lower(), 0.5)
+    )
+
+
+def parse_and_sort(file_path, title: str = '', author: str = ''):
+    """
+    Parse a search result list and rank it, best first. Without a title and
+    author the ranking falls back to format, size and bot reliability.
+    """
+    try:
+        reliability = bot_reliability()
+    except Exception as e:
+        print(f"[!] Bot reliability unavailable: {e}")
+        reliability = {}
+
+    entries = []
+    for entry in iter_entries(file_path):
+        entry['score'] = score_entry(entry, title, author, reliability)
+        entries.append(entry)
 
+    return sorted(entries, key=lambda e: (-e['score'], e['priority']))
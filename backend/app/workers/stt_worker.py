@@ -1,20 +1,32 @@
 # backend/app/stt_worker.py
 import os, subprocess
-from openai import OpenAI, Audio
+from app.workers.openai_client import get_client
 
+STT_MODEL = os.getenv("STT_MODEL", "gpt-4o-transcribe")
 
-def convert_webm_to_wav(input_path: str) -> str:
-    output_path = input_path.replace(".webm", ".wav")
-    if os.path.exists(output_path):
-        os.remove(output_path)
+# Containers the transcription backend accepts as-is. Anything else is
+# transcoded in memory; set this empty for a backend that only takes FLAC/WAV.
+STT_PASSTHROUGH_FORMATS = {
+    ext.strip().lower()
+    for ext in os.getenv("STT_PASSTHROUGH_FORMATS", ".webm,.ogg,.mp3,.m4a,.mp4,.wav,.flac").split(",")
+    if ext.strip()
+}
+
+
+def transcode_to_flac(input_path: str) -> bytes:
+    """
+    Transcode audio to 16 kHz mono FLAC, piping ffmpeg's stdout straight
+    back instead of writing an intermediate WAV next to the upload.
+    """
     try:
-        subprocess.run(
-            ['ffmpeg', '-i', input_path, '-ar', '16000', '-ac', '1', output_path],
+        result = subprocess.run(
+            ['ffmpeg', '-nostdin', '-loglevel', 'error', '-i', input_path,
+             '-ar', '16000', '-ac', '1', '-f', 'flac', 'pipe:1'],
             check=True,
             stderr=subprocess.PIPE,
             stdout=subprocess.PIPE
         )
-        return output_path
+        return result.stdout
     except subprocess.CalledProcessError as e:
         error_msg = e.stderr.decode('utf-8') if e.stderr else str(e)
         print(f"FFmpeg conversion failed: {error_msg}")
@@ -27,21 +39,22 @@ def transcribe_audio_file(file_path: str) -> str:
     Transcribe audio using OpenAI's Whisper-like model via the OpenAI Python SDK.
     Returns the transcript text.
     """
-    # Initialize client
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("Missing OPENAI_API_KEY environment variable!")
-
-    client = OpenAI(api_key=api_key)
-
-    if file_path.endswith(".webm"):
-        file_path = convert_webm_to_wav(file_path)
-
-    # Read the audio file and send for transcription
-    with open(file_path, "rb") as audio_file:
+    # Shared per worker process so connections and TLS sessions are reused
+    client = get_client()
+
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension in STT_PASSTHROUGH_FORMATS:
+        # The compressed upload is smaller than any WAV we'd produce from it
+        with open(file_path, "rb") as audio_file:
+            transcription = client.audio.transcriptions.create(
+                model=STT_MODEL,
+                file=audio_file
+            )
+    else:
+        name = os.path.splitext(os.path.basename(file_path))[0] + ".flac"
         transcription = client.audio.transcriptions.create(
-            model="gpt-4o-transcribe",
-            file=audio_file
+            model=STT_MODEL,
+            file=(name, transcode_to_flac(file_path), "audio/flac")
         )
 
     return transcription.text.strip()
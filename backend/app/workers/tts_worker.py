@@ -1,2 +1,77 @@
-def synthesize_speech(path, dir):
-    return None
\ No newline at end of file
+# backend/app/workers/tts_worker.py
+import io
+import json
+import os
+import wave
+
+import requests
+
+from app.segmenter import section_sentences
+
+VOICE_CLONE_URL = os.getenv("VOICE_CLONE_URL", "http://voice-clone:5002/speak")
+VOICE_CLONE_TIMEOUT = float(os.getenv("VOICE_CLONE_TIMEOUT", 120))
+
+# Reused across tasks so every sentence rides the same keep-alive connection
+session = requests.Session()
+
+
+def synthesize_sentence(sentence: str) -> bytes:
+    response = session.post(VOICE_CLONE_URL, json={"text": sentence}, timeout=VOICE_CLONE_TIMEOUT)
+    response.raise_for_status()
+    return response.content
+
+
+def synthesize_speech(text_path: str, output_dir: str) -> str | None:
+    """
+    Render a section text file to one WAV in output_dir, plus a JSON manifest
+    with each sentence's start/end time in seconds. Returns the WAV path, or
+    None if the section has no speakable text. Already-rendered sections are
+    left as they are.
+    """
+    stem = os.path.splitext(os.path.basename(text_path))[0]
+    audio_path = os.path.join(output_dir, f"{stem}.wav")
+    manifest_path = os.path.join(output_dir, f"{stem}.json")
+    if os.path.exists(audio_path) and os.path.exists(manifest_path):
+        return audio_path
+
+    sentences = section_sentences(text_path)
+    if not sentences:
+        return None
+
+    os.makedirs(output_dir, exist_ok=True)
+    tmp_path = f"{audio_path}.part"
+    tmp_manifest_path = f"{manifest_path}.part"
+    timings = []
+    frames_written = 0
+    out = None
+    try:
+        try:
+            for sentence in sentences:
+                with wave.open(io.BytesIO(synthesize_sentence(sentence)), 'rb') as clip:
+                    if out is None:
+                        out = wave.open(tmp_path, 'wb')
+                        out.setparams(clip.getparams())
+                        framerate = clip.getframerate()
+                    nframes = clip.getnframes()
+                    out.writeframes(clip.readframes(nframes))
+                timings.append({
+                    'text': sentence,
+                    'start': round(frames_written / framerate, 3),
+                    'end': round((frames_written + nframes) / framerate, 3),
+                })
+                frames_written += nframes
+        finally:
+            if out is not None:
+                out.close()
+
+        with open(tmp_manifest_path, 'w', encoding='utf-8') as f:
+            json.dump({'section': os.path.basename(text_path), 'sentences': timings}, f)
+        os.replace(tmp_path, audio_path)
+        os.replace(tmp_manifest_path, manifest_path)
+    except BaseException:
+        # A failed render leaves nothing half-written on the books volume
+        for path in (tmp_path, tmp_manifest_path):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    return audio_path
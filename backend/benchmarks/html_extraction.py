@@ -0,0 +1,111 @@
+"""
+MOBI/AZW3 HTML section extraction: the streaming lxml pass against the
+previous BeautifulSoup traversal.
+
+    cd backend && python -m benchmarks.html_extraction book.azw3 [more.mobi ...]
+    cd backend && python -m benchmarks.html_extraction --synthetic 2000
+
+Peak memory is what tracemalloc sees, i.e. Python objects; that covers the
+soup tree, while the lxml target parser builds no tree at all.
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import mobi
+from bs4 import BeautifulSoup
+
+from app.workers.convert_worker import iter_html_sections, _read_chunks
+
+
+def soup_sections(html_path):
+    """The converter's previous approach, kept here as the baseline."""
+    with open(html_path, 'r', encoding='utf-8', errors='replace') as f:
+        soup = BeautifulSoup(f.read(), 'html.parser')
+
+    sections = []
+    current_title = "Section"
+    current_content = []
+    for element in soup.find_all(True):
+        if element.name in ['h1', 'h2', 'h3']:
+            if current_content:
+                sections.append((current_title, '\n'.join(current_content)))
+                current_content = []
+            current_title = element.get_text(strip=True)
+        else:
+            text = element.get_text(separator='\n', strip=True)
+            if text:
+                current_content.append(text)
+    if current_content:
+        sections.append((current_title, '\n'.join(current_content)))
+    return sections
+
+
+def lxml_sections(html_path):
+    return list(iter_html_sections(_read_chunks(html_path), ('h1', 'h2', 'h3')))
+
+
+def synthetic_html(path, chapters):
+    paragraph = "<p>It was a <i>dark</i> and <b>stormy</b> night; the rain fell in torrents.</p>\n"
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("<html><head><title>Synthetic</title></head><body>\n")
+        for i in range(chapters):
+            f.write(f"<div class='chapter'><h2>Chapter {i + 1}</h2>\n<div>{paragraph * 40}</div></div>\n")
+        f.write("</body></html>\n")
+
+
+def measure(extract, html_path):
+    tracemalloc.start()
+    start = time.perf_counter()
+    sections = extract(html_path)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak, len(sections), sum(len(text) for _, text in sections)
+
+
+def html_files(book_path):
+    if book_path.lower().endswith(('.html', '.htm')):
+        return None, [book_path]
+    temp_dir, _ = mobi.extract(book_path)
+    found = [os.path.join(root, name) for root, _, names in os.walk(temp_dir)
+             for name in sorted(names) if name.endswith(('.html', '.htm'))]
+    return temp_dir, found
+
+
+def report(label, html_path):
+    size_mb = os.path.getsize(html_path) / 1e6
+    print(f"{label}: {size_mb:.1f} MB of HTML")
+    print(f"{'engine':>8} {'seconds':>9} {'MB/s':>8} {'peak MB':>8} {'sections':>9} {'chars':>11}")
+    for name, extract in (('soup', soup_sections), ('lxml', lxml_sections)):
+        seconds, peak, count, chars = measure(extract, html_path)
+        print(f"{name:>8} {seconds:>9.2f} {size_mb / seconds:>8.1f} {peak / 1e6:>8.1f} {count:>9} {chars:>11}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('books', nargs='*', help='.mobi, .azw3 or extracted .html files')
+    parser.add_argument('--synthetic', type=int, metavar='CHAPTERS',
+                        help='also benchmark a generated single-file book')
+    args = parser.parse_args()
+
+    if args.synthetic:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'synthetic.html')
+            synthetic_html(path, args.synthetic)
+            report(f"synthetic ({args.synthetic} chapters)", path)
+
+    for book in args.books:
+        temp_dir, paths = html_files(book)
+        try:
+            for path in paths:
+                report(f"{book} [{os.path.basename(path)}]", path)
+        finally:
+            if temp_dir:
+                mobi.cleanup(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Pages/second of PDF conversion against the number of pool processes.
+
+    cd backend && python -m benchmarks.pdf_conversion book.pdf --workers 1 2 4 8
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import PyPDF2
+
+from app.workers import convert_worker
+from app.workers.convert_worker import PdfConverter
+
+
+def run(pdf_path: str, workers: int, repeat: int) -> float:
+    """Best wall time of repeat conversions with the given pool size."""
+    best = float('inf')
+    for _ in range(repeat):
+        output_dir = tempfile.mkdtemp(prefix='pdfbench_')
+        try:
+            start = time.perf_counter()
+            PdfConverter(workers=workers).convert(pdf_path, output_dir)
+            best = min(best, time.perf_counter() - start)
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('pdf')
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument('--shard-pages', type=int, default=convert_worker.PDF_SHARD_PAGES)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    convert_worker.PDF_SHARD_PAGES = args.shard_pages
+    with open(args.pdf, 'rb') as f:
+        pages = len(PyPDF2.PdfReader(f).pages)
+
+    print(f"{args.pdf}: {pages} pages, {args.shard_pages} pages per shard, best of {args.repeat}")
+    print(f"{'workers':>8} {'seconds':>9} {'pages/s':>9} {'speedup':>8}")
+    baseline = None
+    for workers in args.workers:
+        seconds = run(args.pdf, workers, args.repeat)
+        baseline = baseline or seconds
+        print(f"{workers:>8} {seconds:>9.2f} {pages / seconds:>9.1f} {baseline / seconds:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -52,7 +52,17 @@ export default function App() {
   }
   
   // Use custom hook to poll job status
-  const { phase, result, transcript } = useJobStatus(jobId, import.meta.env.VITE_API_URL, 2000, pullTrigger);
+  const { phase, result, transcript, partial } = useJobStatus(jobId, import.meta.env.VITE_API_URL, 2000, pullTrigger);
+
+  // Show the LLM's reply as it streams in, before the guess is final
+  useEffect(() => {
+    if (!partial) return;
+    if (partial.question) {
+      setGuess(partial.question);
+    } else if (partial.title) {
+      setGuess(partial.author ? `"${partial.title}" by ${partial.author}` : `"${partial.title}"`);
+    }
+  }, [partial]);
   
   useEffect(() => {
     switch (phase) {
@@ -66,7 +76,6 @@ export default function App() {
       break;
       case 'downloaded_list':
       log('[IRC] Downloaded list.')
-      download_book();
       break;
       case 'downloading_book':
       log('[IRC] Downloading book ...')
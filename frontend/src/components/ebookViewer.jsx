@@ -1,51 +1,116 @@
-import React, { useState, useEffect } from 'react';
-import { speakText, stopSpeaking } from '../audioPlayer';
+import React, { useState, useEffect, useRef } from 'react';
+import { speakSection, stopSpeaking } from '../audioPlayer';
 
 const EbookViewer = ({ jobId = 'b4e00eb6-367c-4495-8c2a-7cea89de1b8d'}) => {
   const [sections, setSections] = useState([]);
   const [selected, setSelected] = useState(null);
   const [text, setText] = useState('');
   const [speaking, setSpeaking] = useState(false);
+  // Section names in the packed book, once conversion finished and packed it
+  const [packed, setPacked] = useState(null);
+  const textCache = useRef(new Map());
   const basePath = `${import.meta.env.VITE_API_URL}/ebooks/${jobId}/parsed`;
+  const packPath = `${import.meta.env.VITE_API_URL}/books/${jobId}/sections`;
 
   useEffect(() => {
     if (!jobId) return;
   
     let isMounted = true;
+    let timer = null;
     const pollInterval = 2000; // 2 seconds
+    setSections([]);
+    setSelected(null);
+    setText('');
+    setPacked(null);
+    textCache.current = new Map();
   
+    // index.json appears after the first converted section and keeps growing
+    // until `complete`; older books have a bare array, which is complete.
     const checkForIndex = async () => {
       try {
-        const res = await fetch(`${basePath}/index.json`);
+        const res = await fetch(`${basePath}/index.json`, { cache: 'no-store' });
         if (!res.ok) throw new Error("index.json not ready");
   
         const data = await res.json();
-        if (Array.isArray(data) && isMounted) {
-          setSections(data);
-        } else {
+        const list = Array.isArray(data) ? data : data.sections;
+        const complete = Array.isArray(data) || data.complete;
+        if (!Array.isArray(list)) {
           console.error("Invalid index.json structure:", data);
+          return;
+        }
+        if (!isMounted) return;
+        setSections(list);
+        // Open the first chapter as soon as it exists
+        setSelected((current) => current ?? list[0] ?? null);
+        if (!complete) {
+          timer = setTimeout(checkForIndex, pollInterval);
+        } else {
+          checkForPack(3);
         }
       } catch (err) {
-        setTimeout(checkForIndex, pollInterval); // retry
+        if (isMounted) {
+          timer = setTimeout(checkForIndex, pollInterval); // retry
+        }
       }
     };
   
+    // Finished books are packed right after the index completes; books
+    // without a pack keep using the per-file URLs
+    const checkForPack = async (attempts) => {
+      try {
+        const res = await fetch(packPath);
+        if (!res.ok) throw new Error("pack not ready");
+        const pack = await res.json();
+        if (isMounted) setPacked(pack.sections.map(s => s.name));
+      } catch (err) {
+        if (isMounted && attempts > 1) {
+          timer = setTimeout(() => checkForPack(attempts - 1), pollInterval);
+        }
+      }
+    };
+
     checkForIndex();
   
     return () => {
       isMounted = false;
+      clearTimeout(timer);
     };
   }, [jobId]);
   
 
   useEffect(() => {
-    if (selected) {
-      fetch(`${basePath}/${selected}`)
-        .then(res => res.text())
-        .then(setText)
-        .catch(err => console.error('Error loading section:', err));
-    }
-  }, [selected, basePath]);
+    if (!selected) return;
+
+    const urlFor = (name) => {
+      const n = packed ? packed.indexOf(name) : -1;
+      return n >= 0 ? `${packPath}/${n}` : `${basePath}/${name}`;
+    };
+    const load = (name) => {
+      if (!textCache.current.has(name)) {
+        const request = fetch(urlFor(name)).then(res => {
+          if (!res.ok) throw new Error(`Section ${name} not available`);
+          return res.text();
+        });
+        // Forget failures so the next attempt fetches again
+        request.catch(() => textCache.current.delete(name));
+        textCache.current.set(name, request);
+      }
+      return textCache.current.get(name);
+    };
+
+    let current = true;
+    load(selected)
+      .then(content => {
+        if (current) setText(content);
+        // Readers mostly go on to the next chapter; have it ready
+        const next = sections[sections.indexOf(selected) + 1];
+        if (next) load(next).catch(() => {});
+      })
+      .catch(err => console.error('Error loading section:', err));
+    return () => {
+      current = false;
+    };
+  }, [selected, basePath, packPath, packed, sections]);
 
   const handleSpeak = async () => {
     if (speaking) {
@@ -53,7 +118,7 @@ const EbookViewer = ({ jobId = 'b4e00eb6-367c-4495-8c2a-7cea89de1b8d'}) => {
       setSpeaking(false);
     } else {
       setSpeaking(true);
-      await speakText(text);
+      await speakSection(jobId, selected);
       setSpeaking(false);
     }
   };
@@ -1,67 +1,106 @@
 import { useState, useEffect, useRef } from 'react';
 
 /**
-* Custom hook to poll a job status endpoint until completion.
-* @param {string|null} jobId - The ID of the job to poll.
+* Custom hook to follow a job's status until completion.
+* Subscribes to the server-sent `/events/{job_id}` stream; falls back to
+* polling `/status/{job_id}` when EventSource is unavailable.
+* @param {string|null} jobId - The ID of the job to follow.
 * @param {string} apiUrl - Base URL for the API (no trailing slash).
-* @param {number} intervalMs - Polling interval in milliseconds.
-* @returns {{ phase: string, result: object|null, transcript: string }}
+* @param {number} intervalMs - Polling interval in milliseconds (fallback only).
+* @returns {{ phase: string, result: object|null, transcript: string, partial: object|null }}
 */
 export function useJobStatus(jobId, apiUrl, intervalMs = 2000, trigger = 0) {
     const [phase, setPhase] = useState('idle');
     const [result, setResult] = useState(null);
     const [transcript, setTranscript] = useState('');
+    const [partial, setPartial] = useState(null);
     const lastTranscriptRef = useRef('');
-    const timerRef = useRef(null);
-    
+    const stopRef = useRef(() => {});
+
     useEffect(() => {
         if (!jobId) {
-            clearInterval(timerRef.current);
-            setPhase('idle'); setResult(null); setTranscript('');
+            stopRef.current();
+            setPhase('idle'); setResult(null); setTranscript(''); setPartial(null);
             lastTranscriptRef.current = '';
             return;
           }
 
         setPhase('processing');
-        
-        const poll = async () => {
-            try {
-                const res = await fetch(`${apiUrl}/status/${jobId}`);
-                const data = await res.json();
-                console.log('[DEBUG] Polled data:', data);
-                
-                if (data.phase) {
-                    setPhase(data.phase);
+
+        // Returns true once the job reached a phase we stop listening at
+        const handle = (data) => {
+            console.log('[DEBUG] Job status:', data);
+
+            if (data.phase) {
+                setPhase(data.phase);
+            }
+
+            setPartial(data.phase === 'guessing' ? data.partial_guess : null);
+
+            if (data.transcription && data.transcription !== lastTranscriptRef.current) {
+                lastTranscriptRef.current = data.transcription;
+                setTranscript(data.transcription);
+            }
+
+            if (data.phase === 'guessed' && data.guess) {
+                setResult(data.guess);
+                return true;
+            } else if (data.phase === 'converted_book') {
+                setResult(data.ebook_path);
+                return true;
+            } else if (data.phase === 'failed') {
+                return true;
+            }
+            return false;
+        };
+
+        const fail = (err) => {
+            setPhase('failed');
+            setResult(err)
+            console.error('Job status error:', err);
+            stopRef.current();
+        };
+
+        if (typeof EventSource !== 'undefined') {
+            const source = new EventSource(`${apiUrl}/events/${jobId}`);
+            stopRef.current = () => source.close();
+
+            source.onmessage = (event) => {
+                try {
+                    if (handle(JSON.parse(event.data))) {
+                        source.close();
+                    }
+                } catch (err) {
+                    fail(err);
                 }
-                
-                if (data.transcription && data.transcription !== lastTranscriptRef.current) {
-                    lastTranscriptRef.current = data.transcription;
-                    setTranscript(data.transcription);
+            };
+            // EventSource reconnects on its own; only a closed stream is fatal
+            source.onerror = () => {
+                if (source.readyState === EventSource.CLOSED) {
+                    fail(new Error('Job event stream closed'));
                 }
-                
-                if (data.phase === 'guessed' && data.guess) {
-                    setResult(data.guess);
-                    clearInterval(timerRef.current);
-                } else if (data.phase === 'converted_book') {
-                    setResult(data.ebook_path);
-                    clearInterval(timerRef.current);  
-                } else if (data.phase === 'failed') {
-                    clearInterval(timerRef.current);
+            };
+        } else {
+            let timer = null;
+            stopRef.current = () => clearInterval(timer);
+
+            const poll = async () => {
+                try {
+                    const res = await fetch(`${apiUrl}/status/${jobId}`);
+                    if (handle(await res.json())) {
+                        clearInterval(timer);
+                    }
+                } catch (err) {
+                    fail(err);
                 }
-            } catch (err) {
-                setPhase('failed');
-                setResult(err)
-                console.error('Polling error:', err);
-                clearInterval(timerRef.current);
-            }
-        };
-        
-        poll();
-        timerRef.current = setInterval(poll, intervalMs);
-        
-        
-        return () => clearInterval(timerRef.current);
+            };
+
+            poll();
+            timer = setInterval(poll, intervalMs);
+        }
+
+        return () => stopRef.current();
     }, [jobId, apiUrl, intervalMs, trigger]);
-    
-    return { phase, result, transcript };
+
+    return { phase, result, transcript, partial };
 }
@@ -1,12 +1,82 @@
 # app/server.py
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, request, send_file, jsonify
-import subprocess
 import os
-import uuid
+import threading
+
+from tts_cache import TTSCache, cache_key, file_digest
 
 app = Flask(__name__)
 SPEAKER_WAV = "app/voice_samples/your_sample.wav"
 MODEL_NAME = "tts_models/multilingual/multi-dataset/your_tts"
+LANGUAGE = "en"
+
+# Number of synthesis jobs allowed to run at once. Each worker thread shares
+# the single resident model; torch releases the GIL inside its kernels.
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", 2))
+TTS_THREADS = int(os.getenv("TTS_TORCH_THREADS", 0))
+
+SPEAKER_NAME = "cloned_voice"
+
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "output/cache")
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_MB", 2048)) * 1024 * 1024
+
+cache = TTSCache(TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES)
+# Keyed on the sample's content so swapping the voice invalidates old clips
+SPEAKER_ID = file_digest(SPEAKER_WAV) if os.path.exists(SPEAKER_WAV) else SPEAKER_WAV
+cache.write_manifest(MODEL_NAME, SPEAKER_ID, LANGUAGE)
+
+tts = None
+speaker_registered = False
+model_error = None
+executor = ThreadPoolExecutor(max_workers=TTS_WORKERS)
+model_ready = threading.Event()
+
+
+def register_speaker():
+    """
+    Compute the speaker embedding once and register it under SPEAKER_NAME,
+    so synthesis doesn't re-run the speaker encoder on every request.
+    """
+    global speaker_registered
+    try:
+        manager = tts.synthesizer.tts_model.speaker_manager
+        embedding = manager.compute_embedding_from_clip(SPEAKER_WAV)
+        manager.embeddings_by_names[SPEAKER_NAME] = [embedding]
+        manager.name_to_id[SPEAKER_NAME] = len(manager.name_to_id)
+        speaker_registered = True
+    except Exception as e:
+        # Still correct, just slower: fall back to passing the sample each call
+        print(f"[WARN] Could not cache speaker embedding, using speaker_wav: {e}")
+
+
+def load_model():
+    """Load the TTS model and speaker embedding once and keep them resident."""
+    global tts, model_error
+    try:
+        import torch
+        from TTS.api import TTS
+
+        if TTS_THREADS:
+            torch.set_num_threads(TTS_THREADS)
+
+        tts = TTS(model_name=MODEL_NAME, progress_bar=False, gpu=False)
+        register_speaker()
+        print(f"[INFO] Loaded {MODEL_NAME} with {TTS_WORKERS} synthesis workers")
+    except Exception as e:
+        model_error = str(e)
+        print(f"[ERROR] Failed to load TTS model: {e}")
+    finally:
+        model_ready.set()
+
+
+def synthesize(text: str, output_path: str):
+    if speaker_registered:
+        speaker = {"speaker": SPEAKER_NAME}
+    else:
+        speaker = {"speaker_wav": SPEAKER_WAV}
+    tts.tts_to_file(text=text, language=LANGUAGE, file_path=output_path, **speaker)
+
 
 @app.route("/speak", methods=["POST"])
 def speak():
@@ -15,25 +85,45 @@ def speak():
         return jsonify({"error": "Missing 'text' field"}), 400
 
     text = data["text"]
-    output_path = f"output/{uuid.uuid4().hex}.wav"
+    key = cache_key(text, MODEL_NAME, SPEAKER_ID, LANGUAGE)
+    cached_path = cache.get(key)
+    if cached_path:
+        return send_file(cached_path, mimetype="audio/wav")
+
+    model_ready.wait()
+    if tts is None:
+        return jsonify({"error": f"Model not loaded: {model_error}"}), 503
+
+    output_path = cache.temp_path()
 
     try:
-        subprocess.run([
-            "tts",
-            "--model_name", MODEL_NAME,
-            "--language_idx=en",
-            "--text", text,
-            "--speaker_wav", SPEAKER_WAV,
-            "--out_path", output_path
-        ], check=True)
-    except subprocess.CalledProcessError:
+        executor.submit(synthesize, text, output_path).result()
+    except Exception as e:
+        print(f"[ERROR] Synthesis failed: {e}")
+        if os.path.exists(output_path):
+            os.remove(output_path)
         return jsonify({"error": "Synthesis failed"}), 500
 
-    return send_file(output_path, mimetype="audio/wav")
+    return send_file(cache.commit(key, output_path), mimetype="audio/wav")
 
 @app.route("/")
 def health():
     return "Voice clone API is running."
 
+@app.route("/health")
+def model_health():
+    if not model_ready.is_set():
+        return jsonify({"status": "loading", "model": MODEL_NAME, "loaded": False}), 503
+    if tts is None:
+        return jsonify({"status": "error", "model": MODEL_NAME, "loaded": False, "error": model_error}), 503
+    return jsonify({"status": "ok", "model": MODEL_NAME, "loaded": True, "workers": TTS_WORKERS})
+
+@app.route("/cache/stats")
+def cache_stats():
+    return jsonify(cache.stats())
+
+# Load in the background so /health answers while the model warms up
+threading.Thread(target=load_model, daemon=True).start()
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5002)
+    app.run(host="0.0.0.0", port=5002, threaded=True)
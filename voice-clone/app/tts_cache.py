@@ -0,0 +1,108 @@
+# app/tts_cache.py
+import hashlib
+import json
+import os
+import threading
+import uuid
+
+# Describes the voice every cached clip was rendered with. The backend reads
+# it to compute the same keys and serve hits without calling this service.
+MANIFEST_NAME = "voice.json"
+
+
+def file_digest(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def cache_key(text: str, model: str, speaker: str, language: str) -> str:
+    payload = json.dumps([text.strip(), model, speaker, language])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    """
+    Content-addressed WAV cache on disk. File mtimes double as the LRU
+    order: hits touch the file and eviction removes the oldest first.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self.size = sum(os.path.getsize(p) for p, _ in self._entries())
+
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for file in files:
+                if file.endswith(".wav") and not file.startswith(".tmp"):
+                    path = os.path.join(root, file)
+                    try:
+                        yield path, os.path.getmtime(path)
+                    except FileNotFoundError:
+                        continue
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.wav")
+
+    def write_manifest(self, model: str, speaker: str, language: str):
+        tmp_path = os.path.join(self.cache_dir, f".tmp-{uuid.uuid4().hex}.json")
+        with open(tmp_path, "w") as f:
+            json.dump({"model": model, "speaker": speaker, "language": language}, f)
+        os.replace(tmp_path, os.path.join(self.cache_dir, MANIFEST_NAME))
+
+    def get(self, key: str) -> str | None:
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return path
+
+    def temp_path(self) -> str:
+        return os.path.join(self.cache_dir, f".tmp-{uuid.uuid4().hex}.wav")
+
+    def commit(self, key: str, tmp_path: str) -> str:
+        """Move a finished temp file into place and evict if over budget."""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.size += os.path.getsize(path)
+            if self.size > self.max_bytes:
+                self._evict()
+        return path
+
+    def _evict(self):
+        # Drop to 90% of the budget so we don't rescan on every write
+        target = self.max_bytes * 0.9
+        entries = sorted(self._entries(), key=lambda e: e[1])
+        self.size = sum(os.path.getsize(p) for p, _ in entries)
+        for path, _ in entries:
+            if self.size <= target:
+                break
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self.size -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size_bytes": self.size,
+                "max_bytes": self.max_bytes,
+            }